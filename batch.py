@@ -0,0 +1,196 @@
+import io, os, zipfile, tarfile
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from config import CONFIG
+import ossl
+
+# ============================================================ #
+
+KEY_SUFFIXES = ('.key',)
+MAX_CHAIN_DEPTH = 10
+
+# ============================================================ #
+
+class CertEntry(NamedTuple):
+    filename: str
+    info: ossl.CertInfo
+
+class KeyEntry(NamedTuple):
+    filename: str
+    fingerprint: str
+    pem: bytes
+
+class Pair(NamedTuple):
+    key: KeyEntry
+    cert: CertEntry
+    chain: list[CertEntry]
+
+    @property
+    def name(self) -> str:
+        return self.cert.info.common_name
+
+class BatchIndex(NamedTuple):
+    pairs: list[Pair]
+    unmatched_keys: list[KeyEntry]
+    unmatched_certs: list[CertEntry]
+    errors: list[str]
+
+# ================ ARCHIVES
+
+def read_archive(data: bytes, max_files: int = None, max_unpacked: int = None) -> list[tuple[str, bytes]]:
+    """
+    Unpack a ZIP or (compressed) tar archive in memory, refusing
+    archives with too many files or too much unpacked data.
+    """
+    max_files = max_files or CONFIG.batch_max_files
+    max_unpacked = max_unpacked or CONFIG.batch_max_unpacked
+    files, total = [], 0
+
+    def add(name: str, size: int, read) -> None:
+        nonlocal total
+        if len(files) >= max_files:
+            raise Exception(f'Too many files in the archive (max {max_files})')
+        total += size
+        if total > max_unpacked:
+            raise Exception(f'Archive unpacks to more than {max_unpacked // 2 ** 20} MB')
+        # only the size declared in the header has been checked so far
+        content = read(size + 1)
+        if len(content) > size:
+            raise Exception(f'File "{name}" is larger than declared in the archive')
+        files.append((name, content))
+
+    if zipfile.is_zipfile(io.BytesIO(data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            for item in zf.infolist():
+                if item.is_dir():
+                    continue
+                with zf.open(item) as f:
+                    add(item.filename, item.file_size, f.read)
+        return files
+    try:
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as tf:
+            for item in tf:
+                if not item.isfile():
+                    continue
+                f = tf.extractfile(item)
+                add(item.name, item.size, f.read)
+    except tarfile.TarError:
+        raise Exception('File is neither a ZIP nor a tar archive')
+    return files
+
+# ================ INDEX & MATCHING
+
+def index_files(files: list[tuple[str, bytes]]) -> BatchIndex:
+    """
+    Parse every PEM / DER file, index certificates by their public key
+    fingerprint and pair each private key with its certificate in O(n).
+    Chains are rebuilt for each leaf by following issuer -> subject links
+    among all CA certificates found in the archive.
+    """
+    certs: list[CertEntry] = []
+    keys: list[KeyEntry] = []
+    errors: list[str] = []
+    seen = set()
+
+    for name, data in files:
+        if os.path.basename(name).startswith('.'):
+            continue
+        der_label = 'PRIVATE KEY' if name.lower().endswith(KEY_SUFFIXES) else 'CERTIFICATE'
+        try:
+            blocks = ossl.parse_pem(data, der_label)
+        except Exception as err:
+            errors.append(f'{name}: {str(err)}')
+            continue
+        for block in blocks:
+            pem = ossl.format_block(data, block)
+            try:
+                if block.kind == ossl.KIND_CERT:
+                    info = ossl.inspect_cert(pem)
+                    # the same CA is usually repeated in many chain files
+                    if info.fingerprint not in seen:
+                        seen.add(info.fingerprint)
+                        certs.append(CertEntry(name, info))
+                elif block.kind == ossl.KIND_KEY:
+                    keys.append(KeyEntry(name, ossl.key_fingerprint(pem), pem))
+            except Exception as err:
+                errors.append(f'{name}: {str(err)}')
+
+    by_key: dict[str, list[CertEntry]] = defaultdict(list)
+    by_subject: dict[str, list[CertEntry]] = defaultdict(list)
+    for cert in certs:
+        by_key[cert.info.key_fingerprint].append(cert)
+        if cert.info.is_ca or cert.info.self_signed:
+            by_subject[cert.info.subject].append(cert)
+
+    pairs, unmatched_keys, used = [], [], set()
+    for key in keys:
+        matches = by_key.get(key.fingerprint)
+        if not matches:
+            unmatched_keys.append(key)
+            continue
+        # several certs for one key (renewals): take the one valid the longest
+        cert = max(matches, key=lambda c: c.info.not_after)
+        used.update(c.info.fingerprint for c in matches)
+        pairs.append(Pair(key, cert, build_chain(cert, by_subject)))
+
+    unmatched_certs = [c for c in certs if c.info.fingerprint not in used
+                       and not (c.info.is_ca or c.info.self_signed)]
+    return BatchIndex(pairs, unmatched_keys, unmatched_certs, errors)
+
+def build_chain(leaf: CertEntry, by_subject: dict[str, list[CertEntry]]) -> list[CertEntry]:
+    chain, seen = [], {leaf.info.fingerprint}
+    cert = leaf
+    while not cert.info.self_signed and len(chain) < MAX_CHAIN_DEPTH:
+        issuers = [c for c in by_subject.get(cert.info.issuer, []) if c.info.fingerprint not in seen]
+        if not issuers:
+            break
+        # names may repeat across CAs: prefer the issuer whose key id the cert refers to
+        if cert.info.aki:
+            issuers = [c for c in issuers if c.info.ski == cert.info.aki] or issuers
+        cert = max(issuers, key=lambda c: c.info.not_after)
+        seen.add(cert.info.fingerprint)
+        chain.append(cert)
+    return chain
+
+# ================ OUTPUT
+
+def pair_args(pair: Pair, password: Optional[str]) -> tuple:
+    chain = b''.join(c.info.pem for c in pair.chain) or None
+    return (pair.cert.info.pem, chain, pair.key.pem, pair.name, password)
+
+def unique_name(name: str, used: set) -> str:
+    stem = ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in name).strip('.') or 'cert'
+    fname, n = f'{stem}.p12', 1
+    while fname in used:
+        n += 1
+        fname = f'{stem}-{n}.p12'
+    used.add(fname)
+    return fname
+
+def make_report(index: BatchIndex, results: list) -> str:
+    lines = [f'Pairs: {len(index.pairs)}, converted: {sum(1 for r in results if isinstance(r, bytes))}', '']
+    for pair, res in zip(index.pairs, results):
+        status = 'OK' if isinstance(res, bytes) else f'ERROR: {str(res)}'
+        lines.append(f'{pair.name}: key "{pair.key.filename}" + cert "{pair.cert.filename}"'
+                     f' + {len(pair.chain)} chain cert(s) -> {status}')
+    if index.unmatched_keys:
+        lines += ['', 'Keys without a certificate:']
+        lines += [f'  {k.filename} (public key SHA256 {k.fingerprint})' for k in index.unmatched_keys]
+    if index.unmatched_certs:
+        lines += ['', 'Certificates without a key:']
+        lines += [f'  {c.filename}: {c.info.subject}' for c in index.unmatched_certs]
+    if index.errors:
+        lines += ['', 'Errors:'] + [f'  {e}' for e in index.errors]
+    return '\n'.join(lines) + '\n'
+
+def make_archive(index: BatchIndex, results: list) -> bytes:
+    buf = io.BytesIO()
+    used = set()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for pair, res in zip(index.pairs, results):
+            if isinstance(res, bytes):
+                # PKCS12 is already encrypted / high entropy: do not waste CPU on deflate
+                zf.writestr(unique_name(pair.name, used), res, zipfile.ZIP_STORED)
+        zf.writestr('report.txt', make_report(index, results))
+    return buf.getvalue()
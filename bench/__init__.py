@@ -0,0 +1,128 @@
+import os, sys, time, json, shutil, statistics, tempfile, platform, subprocess as sp
+from pathlib import Path
+
+# ============================================================ #
+
+# benchmarks run offline: give config.Settings something to load without a .env
+_OPENSSL = shutil.which('openssl')
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK-TOKEN')
+os.environ.setdefault('OPENSSL_ROOT', str(Path(_OPENSSL).parent) if _OPENSSL else '')
+os.environ.setdefault('TEMP_DIR', tempfile.gettempdir())
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+KEY_TYPES = {
+    'rsa2048': ['-newkey', 'rsa:2048'],
+    'rsa4096': ['-newkey', 'rsa:4096'],
+    'ec256': ['-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:P-256'],
+}
+
+# ============================================================ #
+
+def openssl(*args, input: bytes = None) -> bytes:
+    from ossl import get_caps
+    res = sp.run([get_caps().exe, *args], input=input, capture_output=True)
+    if res.returncode:
+        raise Exception(res.stderr.decode(errors='replace'))
+    return res.stdout
+
+def make_material(workdir: Path, key_type: str = 'rsa2048', chain_len: int = 1) -> dict:
+    """
+    Generate a CA chain of `chain_len` certs and a leaf cert + key signed by it.
+    Returns {'crt', 'key', 'chain'} as PEM text.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    newkey = KEY_TYPES[key_type]
+    issuer_crt = issuer_key = None
+    chain = []
+    for i in range(chain_len + 1):
+        leaf = i == chain_len
+        stem = workdir / f'{key_type}-{"leaf" if leaf else f"ca{i}"}'
+        subj = f'/CN={"leaf" if leaf else f"bench-ca-{i}"}.{key_type}'
+        key, crt = f'{stem}.key', f'{stem}.crt'
+        if issuer_crt is None:
+            openssl('req', '-x509', *newkey, '-nodes', '-keyout', key, '-out', crt, '-subj', subj, '-days', '30')
+        else:
+            csr = f'{stem}.csr'
+            openssl('req', *newkey, '-nodes', '-keyout', key, '-out', csr, '-subj', subj)
+            ext = ['-extfile', _ext_file(workdir), '-extensions', 'v3_leaf' if leaf else 'v3_ca']
+            openssl('x509', '-req', '-in', csr, '-CA', issuer_crt, '-CAkey', issuer_key,
+                    '-set_serial', str(int(time.time() * 1000) + i), '-days', '30', '-out', crt, *ext)
+        if not leaf:
+            chain.insert(0, Path(crt).read_text())
+        issuer_crt, issuer_key = crt, key
+    return {'crt': Path(issuer_crt).read_text(), 'key': Path(issuer_key).read_text(), 'chain': ''.join(chain)}
+
+def _ext_file(workdir: Path) -> str:
+    ext = workdir / 'x509.ext'
+    if not ext.exists():
+        ext.write_text('[v3_ca]\nbasicConstraints=critical,CA:TRUE\nkeyUsage=keyCertSign,cRLSign\n'
+                       'subjectKeyIdentifier=hash\nauthorityKeyIdentifier=keyid\n'
+                       '[v3_leaf]\nbasicConstraints=CA:FALSE\n'
+                       'subjectKeyIdentifier=hash\nauthorityKeyIdentifier=keyid\n')
+    return str(ext)
+
+def measure(func, n: int, *args, **kwargs) -> dict:
+    times = []
+    for _ in range(n):
+        t = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - t)
+    return summary(times)
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def summary(times: list, total: float = None) -> dict:
+    total = sum(times) if total is None else total
+    return {
+        'n': len(times),
+        'total_s': round(total, 6),
+        'ops_per_s': round(len(times) / total, 2) if total else 0.0,
+        'mean_ms': round(statistics.fmean(times) * 1000, 3) if times else 0.0,
+        'p50_ms': round(percentile(times, 50) * 1000, 3),
+        'p95_ms': round(percentile(times, 95) * 1000, 3),
+        'p99_ms': round(percentile(times, 99) * 1000, 3),
+    }
+
+def report(name: str, results: dict, out: str = None):
+    """
+    Print a human readable table and optionally dump machine readable JSON.
+    """
+    from ossl import check_ossl
+    doc = {'benchmark': name, 'python': platform.python_version(), 'platform': platform.platform(),
+           'openssl': check_ossl(), 'results': results}
+    for case, res in results.items():
+        if isinstance(res, dict) and 'ops_per_s' in res:
+            print(f'{name:>10} | {case:<32} | {res["ops_per_s"]:>10} op/s | '
+                  f'p50 {res["p50_ms"]:>9} ms | p99 {res["p99_ms"]:>9} ms')
+        else:
+            print(f'{name:>10} | {case:<32} | {res}')
+    if out:
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(doc, f, indent=2)
+    return doc
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> list[str]:
+    """
+    Throughput regressions of `results` against `baseline` (both {suite: report doc}):
+    cases whose op/s dropped by more than `tolerance` (0.2 = 20 %).
+    """
+    regressions = []
+    for suite, doc in results.items():
+        base = baseline.get(suite, {}).get('results', {})
+        for case, res in doc['results'].items():
+            old = base.get(case)
+            if not (isinstance(res, dict) and isinstance(old, dict) and old.get('ops_per_s')):
+                continue
+            change = res['ops_per_s'] / old['ops_per_s'] - 1
+            if change < -tolerance:
+                regressions.append(f'{suite} | {case}: {old["ops_per_s"]} -> {res["ops_per_s"]} op/s '
+                                   f'({change:+.0%})')
+    return regressions
@@ -0,0 +1,51 @@
+"""
+Run the offline benchmark suite and optionally fail on regressions (for CI):
+
+    python -m bench --quick --out bench.json
+    python -m bench --quick --out new.json --baseline bench.json --tolerance 0.25
+
+Exit code 1 if any case lost more than `tolerance` of its throughput.
+Baselines are only comparable on the same machine / runner type.
+"""
+import argparse, asyncio, json, sys
+
+from bench import compare, report
+import bench.flow, bench.micro, bench.pem, bench.profiles
+
+# ============================================================ #
+
+def run(quick: bool) -> dict:
+    scale = 1 if quick else 5
+    results = {}
+    results['pem'] = report('pem', bench.pem.run(40 * scale, [1, 10, 100]))
+    results['micro'] = report('micro', bench.micro.run(10 * scale, ['rsa2048', 'ec256'], 3, ['cli', 'crypto']))
+    results['profiles'] = report('profiles', bench.profiles.run(3 * scale, ['ec256'], 2, ['cli', 'crypto'],
+                                                                list(bench.profiles.ossl.PROFILES)))
+    try:
+        results['flow'] = report('flow', asyncio.run(bench.flow.run(['rsa2048:1', 'ec256:3'], 4 * scale, 2, 0.0)))
+    finally:
+        bench.flow.botmain.get_scheduler().shutdown()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='fewer iterations (CI smoke run)')
+    parser.add_argument('--out', help='write JSON results of all suites to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput loss, 0.2 = 20 %%')
+    args = parser.parse_args()
+    results = run(args.quick)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Local fake of the Telegram Bot API for offline benchmarks: serves getUpdates
+(long polling), can push updates to a webhook, answers the send* methods the
+bot uses and serves uploaded files from memory. FakeSession plugs the same
+fake into a Bot in-process, without HTTP. With `limits` the fake enforces
+Telegram's flood limits and answers 429 with retry_after like the real API.
+"""
+import asyncio, hashlib, itertools, json, math, time
+from collections import Counter, defaultdict, deque
+from typing import AsyncGenerator, Optional
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import TelegramMethod
+from aiogram.types import UNSET
+
+# ============================================================ #
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+# documented flood limits as (requests per second, burst): the whole bot, one private chat, one group
+TELEGRAM_LIMITS = {'global': (30, 30), 'private': (1, 3), 'group': (20 / 60, 3)}
+
+# ============================================================ #
+
+class Flood(Exception):
+
+    def __init__(self, retry_after: int):
+        super().__init__(f'Too Many Requests: retry after {retry_after}')
+        self.retry_after = retry_after
+
+    def body(self) -> dict:
+        return {'ok': False, 'error_code': 429, 'description': str(self),
+                'parameters': {'retry_after': self.retry_after}}
+
+# ============================================================ #
+
+class FakeTelegram:
+
+    def __init__(self, token: str, rtt: float = 0.0, host: str = '127.0.0.1', port: int = 0, limits: dict = None):
+        self.token = token
+        # simulated network round-trip added to every API call
+        self.rtt = rtt
+        self.limits = limits
+        self.floods = 0
+        self._buckets: dict = {}
+        self.host = host
+        self.port = port
+        self.updates: deque = deque()
+        self.calls = Counter()
+        self.sent: list = []
+        self.replies: dict[int, list] = defaultdict(list)
+        self.files: dict[str, bytes] = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._sent_event = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+
+    # ================ SERVER
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def api_server(self) -> TelegramAPIServer:
+        return TelegramAPIServer.from_base(self.base_url)
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 2 ** 20)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.handle_file)
+        self._runner = web.AppRunner(app, handle_signals=False, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        if request.match_info['token'] != self.token:
+            return web.json_response({'ok': False, 'error_code': 401, 'description': 'Unauthorized'}, status=401)
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        try:
+            res = await self.call(request.match_info['method'], params)
+        except Flood as err:
+            return web.json_response(err.body(), status=429)
+        if isinstance(res, web.Response):
+            return res
+        return web.json_response({'ok': True, 'result': res})
+
+    async def call(self, method: str, params: dict):
+        self.calls[method] += 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        if self.limits and params.get('chat_id') is not None:
+            self.check_flood(params['chat_id'])
+        handler = getattr(self, f'api_{method}', None)
+        return True if handler is None else await handler(params)
+
+    async def handle_file(self, request: web.Request) -> web.StreamResponse:
+        data = self.files.get(request.match_info['path'])
+        if data is None:
+            return web.Response(status=404)
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        return web.Response(body=data)
+
+    # ================ API METHODS
+
+    async def api_getMe(self, params: dict):
+        return BOT_USER
+
+    async def api_getUpdates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.updates, limit))
+
+    async def api_getFile(self, params: dict):
+        path = params['file_id']
+        return {'file_id': path, 'file_unique_id': self.unique_id(path), 'file_size': len(self.files[path]), 'file_path': path}
+
+    async def api_sendMessage(self, params: dict):
+        return self._record('sendMessage', params, {'text': params.get('text', '')})
+
+    async def api_sendDocument(self, params: dict):
+        doc = params.get('document')
+        # a multipart FileField over HTTP, an aiogram BufferedInputFile in-process
+        body = doc.file.read() if hasattr(doc, 'file') else getattr(doc, 'data', b'')
+        return self._record('sendDocument', params, {
+            'document': {'file_id': f'doc{len(self.sent)}', 'file_unique_id': f'udoc{len(self.sent)}',
+                         'file_size': len(body), 'file_name': getattr(doc, 'filename', 'file')},
+            'caption': params.get('caption', '')}, body)
+
+    # ================ HELPERS
+
+    def check_flood(self, chat_id):
+        """
+        Token buckets per `limits`: one for the bot, one per chat. A request
+        over the limit is refused with the seconds until the next token.
+        """
+        now = time.monotonic()
+        chat_id = int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id
+        kind = 'private' if isinstance(chat_id, int) and chat_id > 0 else 'group'
+        taken = []
+        for key, (rate, burst) in (('global', self.limits['global']), (chat_id, self.limits[kind])):
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens < 1 - 1e-6:
+                self.floods += 1
+                raise Flood(math.ceil((1 - tokens) / rate))
+            taken.append((key, tokens - 1))
+        for key, tokens in taken:
+            self._buckets[key] = (tokens, now)
+
+    def _record(self, method: str, params: dict, extra: dict, body: bytes = None) -> dict:
+        chat_id = int(params['chat_id'])
+        item = (time.perf_counter(), method, chat_id, extra.get('text') or extra.get('caption'), body)
+        self.sent.append(item)
+        self.replies[chat_id].append(item)
+        self._sent_event.set()
+        return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, **extra}
+
+    def count(self, *methods: str) -> int:
+        return sum(1 for s in self.sent if s[1] in methods)
+
+    async def wait_sent(self, n: int, *methods: str, timeout: float = 60):
+        deadline = time.perf_counter() + timeout
+        while self.count(*methods) < n:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                raise TimeoutError(f'Only {self.count(*methods)} of {n} {methods} sent in {timeout} s')
+            self._sent_event.clear()
+            try:
+                await asyncio.wait_for(self._sent_event.wait(), left)
+            except asyncio.TimeoutError:
+                pass
+
+    def make_update(self, user_id: int, text: str = None, document: dict = None, caption: str = None) -> dict:
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': user_id, 'type': 'private'},
+                   'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}}
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if document is not None:
+            message['document'] = document
+        if caption is not None:
+            message['caption'] = caption
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def unique_id(self, name: str) -> str:
+        # like Telegram: the same for the same file, whatever case or chat it is sent in
+        return hashlib.sha256(self.files[name]).hexdigest()[:32]
+
+    def add_file(self, name: str, data: bytes) -> dict:
+        # returns the Document object a user message would carry
+        self.files[name] = data
+        return {'file_id': name, 'file_unique_id': self.unique_id(name), 'file_name': name, 'file_size': len(data)}
+
+    def enqueue(self, *updates: dict):
+        # for getUpdates (polling)
+        self.updates.extend(updates)
+        self._new_updates.set()
+
+    async def push(self, url: str, updates: list, secret: str = None, concurrency: int = 40):
+        """
+        Deliver updates to a webhook like Telegram does: up to `concurrency`
+        parallel connections (setWebhook max_connections).
+        """
+        sem = asyncio.Semaphore(concurrency)
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        async with aiohttp.ClientSession() as session:
+            async def post(update):
+                async with sem:
+                    async with session.post(url, data=json.dumps(update), headers={
+                            'Content-Type': 'application/json', **headers}) as resp:
+                        if resp.status != 200:
+                            raise Exception(f'Webhook answered {resp.status}')
+            await asyncio.gather(*(post(u) for u in updates))
+
+# ================ IN-PROCESS SESSION
+
+class FakeSession(BaseSession):
+    """
+    Bot session answering every API call from a FakeTelegram in the same
+    event loop: measures the bot itself, without sockets or JSON over HTTP.
+    """
+
+    def __init__(self, fake: FakeTelegram):
+        super().__init__(api=TelegramAPIServer.from_base('http://fake.local'))
+        self.fake = fake
+
+    async def close(self) -> None:
+        pass
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = UNSET):
+        request = method.build_request(bot)
+        params = {k: self.prepare_value(v) for k, v in request.data.items() if v is not None and v is not UNSET}
+        params.update(request.files or {})
+        try:
+            res = await self.fake.call(request.method, params)
+        except Flood as err:
+            # raises TelegramRetryAfter like a real 429 answer
+            self.check_response(method, 429, json.dumps(err.body()))
+        return method.build_response({'ok': True, 'result': res}).result
+
+    async def stream_content(self, url: str, timeout: int, chunk_size: int,
+                             raise_for_status: bool) -> AsyncGenerator[bytes, None]:
+        path = url.split('/file/bot', 1)[1].split('/', 1)[1]
+        if self.fake.rtt:
+            await asyncio.sleep(self.fake.rtt)
+        data = self.fake.files[path]
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
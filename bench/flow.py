@@ -0,0 +1,113 @@
+"""
+Load test of the whole MyStates conversation: N simulated users walk through
+start -> cert -> key -> chain -> name -> password -> export concurrently,
+their updates are fed to the real Dispatcher and answered by a fake
+in-process Bot session. Files are uploaded as documents; with --shared-chain
+all users send the same chain file (one file_unique_id), like a forwarded
+intermediate CA bundle.
+
+    python -m bench.flow --users 20 --rounds 3 --cases rsa2048:1 rsa4096:1 ec256:1 rsa2048:4 --out flow.json
+"""
+import argparse, asyncio, tempfile, time
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bench import make_material, summary, report
+from bench.fakeapi import FakeTelegram, FakeSession
+import botmain, ossl
+
+# ============================================================ #
+
+TOKEN = '123456:BENCHMARK-TOKEN'
+PASSWORD = 'bench-pw'
+DEFAULT_CASES = ['rsa2048:1', 'rsa4096:1', 'ec256:1', 'rsa2048:4']
+
+# ============================================================ #
+
+def flow_steps(api: FakeTelegram, user: int, files: dict) -> list:
+    """
+    The updates one user sends for one export, in order.
+    """
+    steps = [('/start', None), ('Начать', None), (None, files['crt']), ('Далее', None),
+             (None, files['key']), ('Далее', None)]
+    steps += [(None, files['chain']) if files.get('chain') else ('Пропустить', None), ('Далее', None)]
+    steps += [('bench', None), ('Далее', None), (PASSWORD, None), ('Завершить', None)]
+    return [api.make_update(user, text, document) for text, document in steps]
+
+async def run_user(api: FakeTelegram, bot: Bot, user: int, files: dict, rounds: int,
+                   flows: list, exports: list, errors: list):
+    for _ in range(rounds):
+        start = time.perf_counter()
+        replies = len(api.replies[user])
+        for update in flow_steps(api, user, files):
+            t = time.perf_counter()
+            # feed_update returns when the handler (and its API calls) is done
+            await botmain.dp.feed_update(bot, Update(**update))
+        exports.append(time.perf_counter() - t)
+        flows.append(time.perf_counter() - start)
+        sent = api.replies[user][replies:]
+        # a rejected upload still ends in a bundle, without what was rejected
+        errors += [r[3] for r in sent if r[3] and r[3].startswith('⛔')]
+        if not any(r[1] == 'sendDocument' for r in sent):
+            errors.append(sent[-1][3] if sent else 'no reply')
+
+async def run_case(key_type: str, chain_len: int, users: int, rounds: int, rtt: float,
+                   shared_chain: bool = False) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        material = make_material(Path(tmp), key_type, chain_len)
+    api = FakeTelegram(TOKEN, rtt)
+    bot = Bot(TOKEN, session=FakeSession(api))
+    files = {}
+    chain = api.add_file('chain.pem', material['chain'].encode()) if shared_chain and material.get('chain') else None
+    for user in range(users):
+        # every user uploads their own documents, as in real life
+        files[user] = {k: api.add_file(f'{user}-{k}.pem', material[k].encode()) for k in ('crt', 'key', 'chain')
+                       if material.get(k)}
+        if chain:
+            files[user]['chain'] = chain
+
+    flows, exports, errors = [], [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(api, bot, 10000 + u, files[u], rounds, flows, exports, errors)
+                           for u in range(users)))
+    total = time.perf_counter() - start
+
+    # the bundles must be real: every one opens and holds the key
+    bodies = [r[4] for r in api.sent if r[1] == 'sendDocument']
+    keyless = sum(1 for body in bodies if ossl.verify_pkcs12(body, PASSWORD)[0] is not True)
+    if errors or keyless or not bodies:
+        raise Exception(f'{key_type}:{chain_len}: {len(errors)} failed flows, {keyless} of {len(bodies)} '
+                        f'bundles without the key ({errors[:1]})')
+
+    res = summary(exports, total)
+    res.update(users=users, rounds=rounds, errors=len(errors), exports_per_s=round(len(exports) / total, 2),
+               flow=summary(flows, total), api_calls=sum(api.calls.values()), downloads=api.calls['getFile'])
+    return res
+
+async def run(cases: list, users: int, rounds: int, rtt: float, shared_chain: bool = False) -> dict:
+    results = {}
+    for case in cases:
+        key_type, _, chain_len = case.partition(':')
+        name = f'flow {case} x{users}' + (' shared chain' if shared_chain else '')
+        results[name] = await run_case(key_type, int(chain_len or 0), users, rounds, rtt, shared_chain)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help='concurrent simulated users')
+    parser.add_argument('--rounds', type=int, default=3, help='exports per user')
+    parser.add_argument('--cases', nargs='+', default=DEFAULT_CASES,
+                        help='key_type:chain_length, key types: rsa2048, rsa4096, ec256')
+    parser.add_argument('--rtt', type=float, default=0.0, help='simulated Bot API round-trip, s')
+    parser.add_argument('--shared-chain', action='store_true', help='all users send the same chain file')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+    try:
+        report('flow', asyncio.run(run(args.cases, args.users, args.rounds, args.rtt, args.shared_chain)), args.out)
+    finally:
+        botmain.get_scheduler().shutdown()
+
+if __name__ == '__main__':
+    main()
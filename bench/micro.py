@@ -0,0 +1,48 @@
+"""
+Micro-benchmarks of the hot helpers: ossl.process_pem on certs, keys and
+chains, ossl.make_pkcs12 per backend and key type, botmain.escape_symbols.
+
+    python -m bench.micro -n 100 --keys rsa2048 rsa4096 ec256 --chain 3 --out micro.json
+"""
+import argparse, tempfile
+from pathlib import Path
+
+from bench import KEY_TYPES, make_material, measure, report
+import botmain, ossl
+
+# ============================================================ #
+
+def run(n: int, keys: list, chain_len: int, backends: list) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        materials = {k: make_material(Path(tmp), k, chain_len) for k in keys}
+
+    for key_type, m in materials.items():
+        results[f'process_pem key {key_type}'] = measure(ossl.process_pem, n * 10, m['key'], 'key')
+    m = next(iter(materials.values()))
+    results['process_pem cert'] = measure(ossl.process_pem, n * 10, m['crt'], 'crt')
+    results[f'process_pem chain x{chain_len}'] = measure(ossl.process_pem, n * 10, m['chain'], 'pem')
+
+    for backend in backends:
+        if not ossl.BACKENDS[backend].available():
+            results[f'make_pkcs12 {backend}'] = 'skipped: backend not available'
+            continue
+        for key_type, m in materials.items():
+            results[f'make_pkcs12 {backend} {key_type}'] = \
+                measure(ossl.make_pkcs12, n, m['crt'], m['chain'], m['key'], 'bench', 'bench', backend=backend)
+
+    results['escape_symbols help'] = measure(botmain.escape_symbols, n * 100, botmain.BOT_HELP)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=100, help='PKCS12 exports per case (x10 / x100 for the cheap helpers)')
+    parser.add_argument('--keys', nargs='+', default=list(KEY_TYPES), help='key types')
+    parser.add_argument('--chain', type=int, default=3, help='CA certificates in the chain')
+    parser.add_argument('--backends', nargs='+', default=list(ossl.BACKENDS), help='PKCS12 backends')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+    report('micro', run(args.n, args.keys, args.chain, args.backends), args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Micro-benchmark of ossl.process_pem / ossl.parse_pem against the previous
+line-based implementation on PEM bundles of growing size.
+
+    python -m bench.pem -n 200 --sizes 1 10 100 500 --out pem.json
+"""
+import argparse, tempfile
+from pathlib import Path
+
+from bench import make_material, measure, report
+import ossl
+
+# ============================================================ #
+
+def legacy_process_pem(pem: str) -> bytes:
+    # the pre-parser implementation: one block per input, inner BEGIN / END lines glued into the body
+    lines_pem = [l.strip() for l in pem.splitlines() if l.strip()]
+    if len(lines_pem) < 3 or not (lines_pem[0].startswith(ossl.PEM_START) and lines_pem[-1].startswith(ossl.PEM_END)):
+        raise Exception('Wrong PEM format')
+    if len(lines_pem) > 3:
+        lines_pem = [lines_pem[0], ''.join(lines_pem[1:-1]), lines_pem[-1]]
+    return ossl.NL.join(lines_pem).encode(ossl.ENC)
+
+def run(n: int, sizes: list) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = make_material(Path(tmp))['crt']
+    for size in sizes:
+        text = cert * size
+        data = text.encode(ossl.ENC)
+        results[f'legacy x{size}'] = measure(legacy_process_pem, n, text)
+        results[f'parse_pem x{size}'] = measure(ossl.parse_pem, n, data)
+        results[f'process_pem x{size}'] = measure(ossl.process_pem, n, text, 'bench')
+        blocks = len(ossl.parse_pem(data))
+        if blocks != size:
+            raise Exception(f'parse_pem found {blocks} blocks instead of {size}')
+        results[f'process_pem x{size}']['mb_per_s'] = \
+            round(len(data) * results[f'process_pem x{size}']['ops_per_s'] / 2 ** 20, 2)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=200, help='iterations per case')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 500], help='certificates per bundle')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+    report('pem', run(args.n, args.sizes), args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Exports per second with a fresh openssl process per call vs. a pool of warm
+interactive openssl sessions (OpenSSL 1.x only).
+
+    python -m bench.pool -n 50 --size 4 --out pool.json
+"""
+import argparse, tempfile
+from pathlib import Path
+
+from bench import make_material, measure, report
+import ossl
+
+# ============================================================ #
+
+def run(n: int, size: int, key_type: str) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        m = make_material(Path(tmp), key_type)
+        args = (m['crt'], m['chain'], m['key'], 'bench', 'bench')
+
+        ossl.CONFIG.ossl_pool_size = 0
+        ossl.close_pool()
+        results['spawn'] = measure(ossl.make_pkcs12, n, *args, backend='cli')
+
+        ossl.CONFIG.ossl_pool_size = size
+        if ossl.get_pool() is None:
+            results['pooled'] = f'skipped: {ossl.get_caps().version} has no interactive mode'
+        else:
+            # warm up all sessions before measuring
+            ossl.make_pkcs12(*args, backend='cli')
+            results['pooled'] = measure(ossl.make_pkcs12, n, *args, backend='cli')
+            results['speedup'] = round(results['pooled']['ops_per_s'] / results['spawn']['ops_per_s'], 2)
+        ossl.close_pool()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=50, help='exports per case')
+    parser.add_argument('--size', type=int, default=2, help='pool size')
+    parser.add_argument('--key', default='rsa2048', help='key type: rsa2048, rsa4096, ec256')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+    report('pool', run(args.n, args.size, args.key), args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Cost of the PKCS12 encryption profiles (ossl.PROFILES) per backend and key
+type: export time (ossl.make_pkcs12) and import time of the bundle, i.e.
+what a client pays to open it with the password (cryptography load_pkcs12,
+the OpenSSL CLI without it).
+
+    python -m bench.profiles -n 20 --keys rsa2048 ec256 --chain 2 --out profiles.json
+"""
+import argparse, tempfile
+from pathlib import Path
+
+from bench import KEY_TYPES, make_material, measure, report
+import ossl
+
+# ============================================================ #
+
+PASSWORD = 'bench-pw'
+
+# ============================================================ #
+
+def open_bundle(data: bytes, password: str):
+    if ossl.pkcs12 is not None:
+        return ossl.pkcs12.load_pkcs12(data, password.encode(ossl.ENC))
+    return ossl.verify_pkcs12(data, password)
+
+def run(n: int, keys: list, chain_len: int, backends: list, profiles: list) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        materials = {k: make_material(Path(tmp), k, chain_len) for k in keys}
+
+    for backend in backends:
+        if not ossl.BACKENDS[backend].available():
+            results[f'{backend}'] = 'skipped: backend not available'
+            continue
+        for profile in profiles:
+            for key_type, m in materials.items():
+                case = f'{backend} {profile} {key_type}'
+                args = (m['crt'], m['chain'], m['key'], 'bench', PASSWORD)
+                try:
+                    data = ossl.make_pkcs12(*args, backend=backend, profile=profile)
+                except Exception as err:
+                    # e.g. a profile option the local OpenSSL does not have
+                    results[f'export {case}'] = f'skipped: {str(err).strip()}'
+                    continue
+                res = measure(ossl.make_pkcs12, n, *args, backend=backend, profile=profile)
+                res['bytes'] = len(data)
+                results[f'export {case}'] = res
+                results[f'import {case}'] = measure(open_bundle, n, data, PASSWORD)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=20, help='exports / imports per case')
+    parser.add_argument('--keys', nargs='+', default=['rsa2048', 'ec256'], choices=list(KEY_TYPES), help='key types')
+    parser.add_argument('--chain', type=int, default=2, help='CA certificates in the chain')
+    parser.add_argument('--backends', nargs='+', default=list(ossl.BACKENDS), help='PKCS12 backends')
+    parser.add_argument('--profiles', nargs='+', default=list(ossl.PROFILES), help='PKCS12 profiles')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+    report('profiles', run(args.n, args.keys, args.chain, args.backends, args.profiles), args.out)
+
+if __name__ == '__main__':
+    main()
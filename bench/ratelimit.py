@@ -0,0 +1,102 @@
+"""
+Bursts of outgoing Bot API calls against a fake Telegram that enforces the
+documented flood limits: N chats answer M messages and a document at once,
+after some work wrapped in a chat action like the handlers. Compares the bot without the
+limiter (a 429 is retried after sleeping retry_after) and with ratelimit.
+Latencies are per request, from the call until Telegram accepted it.
+
+    python -m bench.ratelimit --users 50 --rounds 3 --messages 2 --out ratelimit.json
+"""
+import argparse, asyncio, random, time
+from collections import defaultdict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import BufferedInputFile
+from aiogram.utils.chat_action import ChatActionSender
+
+from bench import summary, report
+from bench.fakeapi import FakeTelegram, FakeSession, TELEGRAM_LIMITS
+import ratelimit
+
+# ============================================================ #
+
+TOKEN = '123456:BENCHMARK-TOKEN'
+DOCUMENT = BufferedInputFile(b'\x30' * 4096, 'bench.p12')
+
+# ============================================================ #
+
+async def send(bot: Bot, kind: str, chat_id: int, latencies: dict, errors: list):
+    start = time.perf_counter()
+    while True:
+        try:
+            if kind == 'document':
+                await bot.send_document(chat_id, DOCUMENT)
+            else:
+                await bot.send_message(chat_id, 'bench')
+            break
+        except TelegramRetryAfter as err:
+            if bot.session.middleware:
+                # the limiter gave up after its own retries
+                errors.append(str(err))
+                return
+            await asyncio.sleep(err.retry_after)
+    latencies[kind].append(time.perf_counter() - start)
+
+async def run_user(bot: Bot, chat_id: int, rounds: int, messages: int, think: float, work: float,
+                   latencies: dict, errors: list):
+    for _ in range(rounds):
+        # users do not click in lockstep
+        await asyncio.sleep(random.uniform(0, think))
+        async with ChatActionSender.upload_document(bot=bot, chat_id=chat_id):
+            # the conversion
+            await asyncio.sleep(work)
+            for _ in range(messages):
+                await send(bot, 'message', chat_id, latencies, errors)
+            await send(bot, 'document', chat_id, latencies, errors)
+
+async def run_case(limited: bool, users: int, rounds: int, messages: int, think: float, work: float,
+                   limits: dict) -> dict:
+    api = FakeTelegram(TOKEN, limits=limits)
+    bot = Bot(TOKEN, session=FakeSession(api))
+    if limited:
+        bot.session.middleware(ratelimit.RateLimiter())
+    latencies, errors, lost = defaultdict(list), [], []
+    # without the limiter a 429 kills the ChatActionSender task: count those instead of logging
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: lost.append(context.get('exception')))
+    dropped = ratelimit.ACTIONS_DROPPED.labels().value
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(bot, 10000 + u, rounds, messages, think, work, latencies, errors)
+                           for u in range(users)))
+    total = time.perf_counter() - start
+    res = summary(latencies['message'] + latencies['document'], total)
+    res.update(document=summary(latencies['document'], total), floods=api.floods, errors=len(errors),
+               chat_actions=api.calls['sendChatAction'], action_tasks_failed=len(lost),
+               actions_dropped=ratelimit.ACTIONS_DROPPED.labels().value - dropped)
+    return res
+
+async def run(users: int, rounds: int, messages: int, think: float, work: float, limits: dict) -> dict:
+    results = {}
+    for limited in (False, True):
+        name = f'{"ratelimit" if limited else "retry_after"} x{users}'
+        results[name] = await run_case(limited, users, rounds, messages, think, work, limits)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='chats answered concurrently')
+    parser.add_argument('--rounds', type=int, default=3, help='bursts per chat')
+    parser.add_argument('--messages', type=int, default=2, help='text messages before the document')
+    parser.add_argument('--think', type=float, default=1.0, help='max random pause before each burst, s')
+    parser.add_argument('--work', type=float, default=0.2, help='simulated conversion time under the chat action, s')
+    parser.add_argument('--chat-rate', type=float, help='messages per second the fake allows per private chat '
+                                                       '(below the limiter rate to exercise retry_after)')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+    limits = dict(TELEGRAM_LIMITS)
+    if args.chat_rate:
+        limits['private'] = (args.chat_rate, limits['private'][1])
+    report('ratelimit', asyncio.run(run(args.users, args.rounds, args.messages, args.think, args.work, limits)), args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Update throughput of long polling vs. webhook mode against a local fake
+Telegram API with a simulated network round-trip.
+
+    python -m bench.webhook -n 500 --users 500 --rtt 0.02 --out webhook.json
+"""
+import argparse, asyncio, time
+
+from aiogram import Bot
+from pydantic import SecretStr
+
+from bench import summary, report
+from bench.fakeapi import FakeTelegram
+import botmain, webhook
+from files import PooledSession
+
+# ============================================================ #
+
+SECRET = 'bench-secret'
+
+# ============================================================ #
+
+def latencies(api: FakeTelegram, sent_at: dict, start: int) -> list:
+    # time from an update entering the system to the bot's answer, per chat (first answer wins)
+    res, seen = [], set()
+    for t, method, chat_id, _, _ in api.sent[start:]:
+        if chat_id not in seen and chat_id in sent_at:
+            seen.add(chat_id)
+            res.append(t - sent_at[chat_id])
+    return res
+
+async def run_polling(api: FakeTelegram, bot: Bot, n: int, users: int) -> dict:
+    start = len(api.sent)
+    updates = [api.make_update(1000 + i % users, '/help') for i in range(n)]
+    task = asyncio.create_task(botmain.dp.start_polling(bot, handle_signals=False, close_bot_session=False,
+                                                        polling_timeout=1))
+    await asyncio.sleep(0.2)
+    t0 = time.perf_counter()
+    sent_at = {u['message']['chat']['id']: t0 for u in updates}
+    api.enqueue(*updates)
+    await api.wait_sent(start + n, 'sendMessage')
+    total = time.perf_counter() - t0
+    await botmain.dp.stop_polling()
+    await task
+    res = summary(latencies(api, sent_at, start), total)
+    res.update(updates=n, updates_per_s=round(n / total, 2), get_updates_calls=api.calls['getUpdates'])
+    return res
+
+async def run_webhook(api: FakeTelegram, bot: Bot, n: int, users: int, port: int) -> dict:
+    start = len(api.sent)
+    botmain.CONFIG.webhook_secret = SecretStr(SECRET)
+    botmain.CONFIG.webhook_host, botmain.CONFIG.webhook_port = '127.0.0.1', port
+    botmain.CONFIG.webhook_url = f'http://127.0.0.1:{port}{botmain.CONFIG.webhook_path}'
+    stop = asyncio.Event()
+    await webhook.register(bot)
+    task = asyncio.create_task(webhook.serve(botmain.dp, bot, set_webhook=False, stop=stop))
+    await asyncio.sleep(0.2)
+    updates = [api.make_update(1000 + i % users, '/help') for i in range(n)]
+    t0 = time.perf_counter()
+    sent_at = {u['message']['chat']['id']: t0 for u in updates}
+    await api.push(botmain.CONFIG.webhook_url, updates, SECRET,
+                   botmain.CONFIG.webhook_max_connections)
+    await api.wait_sent(start + n, 'sendMessage')
+    total = time.perf_counter() - t0
+    stop.set()
+    await task
+    res = summary(latencies(api, sent_at, start), total)
+    res.update(updates=n, updates_per_s=round(n / total, 2))
+    return res
+
+async def run(n: int, users: int, rtt: float, port: int) -> dict:
+    token = '123456:BENCHMARK-TOKEN'
+    api = FakeTelegram(token, rtt)
+    await api.start()
+    results = {}
+    try:
+        bot = Bot(token, session=PooledSession(api=api.api_server()))
+        results['polling'] = await run_polling(api, bot, n, users)
+        results['webhook'] = await run_webhook(api, bot, n, users, port)
+        results['speedup'] = round(results['webhook']['updates_per_s'] / results['polling']['updates_per_s'], 2)
+        await bot.session.close()
+    finally:
+        await api.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=500, help='updates per mode')
+    parser.add_argument('--users', type=int, default=500, help='distinct chats')
+    parser.add_argument('--rtt', type=float, default=0.02, help='simulated Bot API round-trip, s')
+    parser.add_argument('--port', type=int, default=8089, help='local webhook port')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+    report('webhook', asyncio.run(run(args.n, args.users, args.rtt, args.port)), args.out)
+
+if __name__ == '__main__':
+    main()
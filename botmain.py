@@ -1,17 +1,30 @@
 import logging
 import asyncio
+from functools import partial
+from typing import Optional
 from aiogram import Bot, Dispatcher, F, html
 from aiogram.filters import Command, Text
 from aiogram.utils import markdown as md
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, Message, BufferedInputFile, ReplyKeyboardRemove
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, Message, BufferedInputFile, ReplyKeyboardRemove, Document
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.chat_action import ChatActionMiddleware, ChatActionSender
 
 from config import CONFIG
 import ossl
+from jobs import get_scheduler, QueueFullError
+import worker
+from files import download_document, download_bytes, make_session, FileRejected
+import batch
+from storage import make_storage
+import validate
+import filecache
+from validate import ValidationError
+import webhook
+import metrics
+from monitoring import MetricsMiddleware, serve_metrics
+import ratelimit
 
 # ============================================================ #
 
@@ -38,13 +51,17 @@ BOT_HELP = \
 -----END ... -----
 
 Нажмите или наберите "Начать", чтобы приступить. 
+Нажмите "Пакет", чтобы загрузить архив (ZIP / TAR) с множеством ключей и сертификатов и получить архив .p12.
 В любое время нажмите / наберите "Сброс", чтобы сбросить операцию и вернуться к началу.
 """
 
 logging.basicConfig(level=logging.INFO)
 
-bot = Bot(token=CONFIG.bot_token.get_secret_value())
-dp = Dispatcher(storage=MemoryStorage())
+bot = Bot(token=CONFIG.bot_token.get_secret_value(), session=make_session())
+if CONFIG.rate_limit:
+    ratelimit.install(bot)
+dp = Dispatcher(storage=make_storage())
+dp.message.middleware(MetricsMiddleware())
 dp.message.middleware(ChatActionMiddleware())
 
 # ============================================================ #
@@ -56,12 +73,21 @@ class MyStates(StatesGroup):
     sending_chain_state = State()
     setting_name_state = State()
     setting_pw_state = State()
+    batch_state = State()
 
-START_BUTTONS = ['Проверка SSL', 'Начать', 'Сброс']
+START_BUTTONS = ['Проверка SSL', 'Начать', 'Пакет', 'Сброс']
+BATCH_BUTTONS = ['Сброс']
+RESET_BUTTONS = ['Сброс']
 CRT_BUTTONS = ['Сброс', 'Загрузить повторно', 'Далее']
 SKIP_BUTTONS = ['Пропустить']
 NAME_BUTTONS = ['Сброс', 'Изменить имя', 'Далее']
-PW_BUTTONS = ['Сброс', 'Изменить пароль', 'Завершить']
+PW_BUTTONS = ['Сброс', 'Изменить пароль', 'Шифрование', 'Завершить']
+# PKCS12 encryption profiles (ossl.PROFILES) offered in the flow
+PROFILE_BUTTONS = {'Совместимое': 'legacy-compatible', 'Современное': 'modern', 'Быстрое': 'fast',
+                   'По умолчанию': 'default'}
+
+STAGE_UPLOAD = metrics.stage('upload')
+STAGE_WORKER = metrics.stage('worker')
 
 # ============================================================ #
 
@@ -77,6 +103,91 @@ def escape_symbols(msg: str) -> str:
         msg_ = msg_.replace(k, v)
     return msg_
 
+async def convert(message: Message, *args, normalized: bool = False, profile: str = None) -> bytes:
+    if CONFIG.worker_socket:
+        try:
+            with STAGE_WORKER.time():
+                return await worker.convert(CONFIG.worker_socket, *args, normalized=normalized, profile=profile)
+        except worker.WorkerUnavailable as err:
+            logging.warning(f'Conversion worker unavailable, converting in-process: {str(err)}')
+    job = get_scheduler().submit(message.from_user.id, ossl.make_pkcs12, *args, normalized=normalized, profile=profile)
+    if job.position:
+        await message.answer(f'⏳ Ваш запрос в очереди, позиция: {job.position}')
+    return await job
+
+def cert_summary(meta: dict) -> str:
+    return f'{meta["name"]}, действует до {meta["not_after"][:10]}'
+
+async def check_upload(message: Message, check, text: str, *args, digest: str = None, **kwargs) -> Optional[dict]:
+    # parse and check the material once, when it arrives; None = rejected (the user was told why).
+    # The result for a cached file (digest) is reused for the same context
+    cache = filecache.get_cache()
+    key = digest and filecache.result_key(check.__name__, *args)
+    res = key and cache.result(digest, key)
+    if res:
+        return res
+    try:
+        res = await asyncio.to_thread(check, text, *args, **kwargs)
+    except ValidationError as err:
+        await message.reply(f'⛔ {str(err)}', reply_markup=make_keyboard(SKIP_BUTTONS))
+        return None
+    if key:
+        cache.store_result(digest, key, res, validate.valid_until(res['meta']))
+    return res
+
+def stored(field: str, pem: str, document: Document = None) -> dict:
+    # an uploaded file is kept in the file cache, the state only gets its reference
+    ref = filecache.reference(pem, document) if document else None
+    return {field: None if ref else pem, f'{field}_ref': ref}
+
+async def stored_pem(bot: Bot, data: dict, field: str) -> Optional[str]:
+    ref = data.get(f'{field}_ref')
+    if not ref:
+        return data.get(field)
+    text, normalized = await filecache.resolve(bot, ref)
+    if not normalized:
+        # evicted from the cache: the original file again, reduced to what was checked at upload
+        text = await asyncio.to_thread(validate.restore, text, data[f'{field}_meta'])
+    return text
+
+async def accept_crt(message: Message, state: FSMContext, text: str, source: str = '',
+                     document: Document = None, digest: str = None):
+    data = await state.get_data()
+    res = await check_upload(message, validate.check_cert, text, data.get('priv_fp'), digest=digest)
+    if res is None:
+        return
+    await state.update_data({**stored('crt', res['pem'], document), 'crt_meta': res['meta']})
+    await message.answer(f'✅ Получен SSL сертификат (.crt, .pem){source}{ossl.NL}{cert_summary(res["meta"])}', 
+                         reply_markup=make_keyboard(CRT_BUTTONS))
+
+async def accept_priv(message: Message, state: FSMContext, text: str, source: str = ''):
+    data = await state.get_data()
+    res = await check_upload(message, validate.check_key, text, (data.get('crt_meta') or {}).get('key_fingerprint'))
+    if res is None:
+        return
+    await state.update_data({'priv': res['pem'], 'priv_fp': res['fingerprint']})
+    match = f'{ossl.NL}Ключ соответствует сертификату' if data.get('crt_meta') else ''
+    await message.answer(f'✅ Получен приватный ключ (.key, .pem){source}{match}', 
+                         reply_markup=make_keyboard(CRT_BUTTONS))
+
+async def accept_chain(message: Message, state: FSMContext, bot: Bot, text: str, source: str = '',
+                       document: Document = None, digest: str = None):
+    data = await state.get_data()
+    leaf = await stored_pem(bot, data, 'crt')
+    infos = await filecache.parsed_certs(digest, text) if digest else None
+    res = await check_upload(message, validate.check_chain, text, leaf, data.get('priv_fp'),
+                             digest=digest, infos=infos, leaf_meta=data.get('crt_meta'))
+    if res is None:
+        return
+    await state.update_data({**stored('chain', res['pem'] or None, document if res['pem'] else None),
+                             'chain_meta': res['meta']})
+    lines = [f'✅ Получена цепочка сертификатов{source}'] + [cert_summary(m) for m in res['meta']['certs']]
+    if res['dropped']:
+        lines.append(f'Не относятся к цепочке и пропущены: {res["dropped"]}')
+    if res['duplicates']:
+        lines.append(f'Повторяющиеся сертификаты удалены: {res["duplicates"]}')
+    await message.answer(ossl.NL.join(lines), reply_markup=make_keyboard(CRT_BUTTONS))
+
 # ================ 1 - СТАРТ
 
 @dp.message(Command(commands=['start', 'help']))
@@ -91,7 +202,7 @@ async def start(message: Message, state: FSMContext):
 
 @dp.message(MyStates.start_state, Text(text='Проверка SSL'))
 async def checkssl(message: Message):
-    res = ossl.check_ossl()
+    res = await asyncio.to_thread(ossl.check_ossl)
     if res:
         await message.reply(f'👍 OpenSSL установлен: {res}', 
                              reply_markup=make_keyboard(START_BUTTONS))
@@ -111,29 +222,28 @@ async def send_crt(message: Message, state: FSMContext):
 @dp.message(MyStates.sending_crt_state, F.text.startswith('-----BEGIN CERTIFICATE-----'))
 async def send_crt_text(message: Message, state: FSMContext):
     # await state.set_state(MyStates.sending_crt_state)
-    await state.update_data({'crt': message.text})    
-    await message.answer('✅ Получен SSL сертификат (.crt, .pem)', 
-                         reply_markup=make_keyboard(CRT_BUTTONS))
+    await accept_crt(message, state, message.text)
 
 @dp.message(MyStates.sending_crt_state, F.document)
 async def send_crt_file(message: Message, state: FSMContext, bot: Bot):
     # await state.set_state(MyStates.sending_crt_state)
-    file = await bot.get_file(message.document.file_id)
-    iostream = await bot.download_file(file.file_path)
-    await state.update_data({'crt': iostream.getvalue().decode(ossl.ENC)})
-    await message.answer(f'✅ Получен SSL сертификат (.crt, .pem): {message.document.file_name}',
-                         reply_markup=make_keyboard(CRT_BUTTONS))  
+    try:
+        text, digest = await filecache.download_document(bot, message.document, 'CERTIFICATE')
+    except FileRejected as err:
+        await message.reply(f'⛔ {str(err)}', reply_markup=make_keyboard(SKIP_BUTTONS))
+        return
+    await accept_crt(message, state, text, f': {message.document.file_name}', message.document, digest)
     
 @dp.message(MyStates.sending_crt_state, Text(text='Пропустить'))
 async def send_crt_skip(message: Message, state: FSMContext):
     # await state.set_state(MyStates.sending_crt_state)
-    await state.update_data({'crt': None})    
+    await state.update_data({'crt': None, 'crt_ref': None, 'crt_meta': None})    
     await message.reply('✘ SSL сертификат пропущен', 
                          reply_markup=make_keyboard(CRT_BUTTONS))
 
 @dp.message(MyStates.sending_crt_state, Text(text='Загрузить повторно'))
 async def send_crt_text_reload(message: Message, state: FSMContext):
-    await state.update_data({'crt': None})
+    await state.update_data({'crt': None, 'crt_ref': None, 'crt_meta': None})
     await message.answer('✍ Отправьте текст или файл SSL сертификата (.crt, .pem) или нажмите кнопку "Пропустить", если его нет', 
                          reply_markup=make_keyboard(SKIP_BUTTONS))
         
@@ -150,28 +260,28 @@ async def crt_next(message: Message, state: FSMContext):
 @dp.message(MyStates.sending_key_state, F.text.contains('PRIVATE KEY-----'))
 async def send_priv_text(message: Message, state: FSMContext):
     # await state.set_state(MyStates.sending_priv_state)
-    await state.update_data({'priv': message.text})    
-    await message.answer('✅ Получен приватный ключ (.key, .pem)', 
-                         reply_markup=make_keyboard(CRT_BUTTONS))
+    await accept_priv(message, state, message.text)
 
 @dp.message(MyStates.sending_key_state, F.document)
 async def send_priv_file(message: Message, state: FSMContext, bot: Bot):
-    file = await bot.get_file(message.document.file_id)
-    iostream = await bot.download_file(file.file_path)
-    await state.update_data({'priv': iostream.getvalue().decode(ossl.ENC)})
-    await message.answer(f'✅ Получен приватный ключ (.key, .pem): {message.document.file_name}',
-                         reply_markup=make_keyboard(CRT_BUTTONS))  
+    try:
+        # private keys never go to the file cache
+        text = await download_document(bot, message.document, 'PRIVATE KEY')
+    except FileRejected as err:
+        await message.reply(f'⛔ {str(err)}', reply_markup=make_keyboard(SKIP_BUTTONS))
+        return
+    await accept_priv(message, state, text, f': {message.document.file_name}')
     
 @dp.message(MyStates.sending_key_state, Text(text='Пропустить'))
 async def send_priv_skip(message: Message, state: FSMContext):
     # await state.set_state(MyStates.sending_priv_state)
-    await state.update_data({'priv': None})    
+    await state.update_data({'priv': None, 'priv_fp': None})    
     await message.reply('✘ Приватный ключ пропущен', 
                          reply_markup=make_keyboard(CRT_BUTTONS))
 
 @dp.message(MyStates.sending_key_state, Text(text='Загрузить повторно'))
 async def send_priv_text_reload(message: Message, state: FSMContext):
-    await state.update_data({'priv': None})  
+    await state.update_data({'priv': None, 'priv_fp': None})  
     await message.answer('✍ Отправьте текст или файл приватного ключа (.key, .pem) или нажмите кнопку "Пропустить", если его нет', 
                          reply_markup=make_keyboard(SKIP_BUTTONS))
 
@@ -186,30 +296,29 @@ async def priv_next(message: Message, state: FSMContext):
     # await message.answer(data['crt'], reply_markup=ReplyKeyboardRemove())
       
 @dp.message(MyStates.sending_chain_state, F.text.startswith('-----BEGIN'))
-async def send_chain_text(message: Message, state: FSMContext):
+async def send_chain_text(message: Message, state: FSMContext, bot: Bot):
     # await state.set_state(MyStates.sending_priv_state)
-    await state.update_data({'chain': message.text})    
-    await message.answer('✅ Получена цепочка сертификатов', 
-                         reply_markup=make_keyboard(CRT_BUTTONS))
+    await accept_chain(message, state, bot, message.text)
 
 @dp.message(MyStates.sending_chain_state, F.document)
 async def send_chain_file(message: Message, state: FSMContext, bot: Bot):
-    file = await bot.get_file(message.document.file_id)
-    iostream = await bot.download_file(file.file_path)
-    await state.update_data({'chain': iostream.getvalue().decode(ossl.ENC)})
-    await message.answer(f'✅ Получена цепочка сертификатов: {message.document.file_name}',
-                         reply_markup=make_keyboard(CRT_BUTTONS))  
+    try:
+        text, digest = await filecache.download_document(bot, message.document, 'CERTIFICATE')
+    except FileRejected as err:
+        await message.reply(f'⛔ {str(err)}', reply_markup=make_keyboard(SKIP_BUTTONS))
+        return
+    await accept_chain(message, state, bot, text, f': {message.document.file_name}', message.document, digest)
     
 @dp.message(MyStates.sending_chain_state, Text(text='Пропустить'))
 async def send_chain_skip(message: Message, state: FSMContext):
     # await state.set_state(MyStates.sending_priv_state)
-    await state.update_data({'chain': None})    
+    await state.update_data({'chain': None, 'chain_ref': None, 'chain_meta': None})    
     await message.reply('✘ Цепочка сертификатов пропущена', 
                          reply_markup=make_keyboard(CRT_BUTTONS))
 
 @dp.message(MyStates.sending_chain_state, Text(text='Загрузить повторно'))
 async def send_chain_text_reload(message: Message, state: FSMContext):
-    await state.update_data({'chain': None})  
+    await state.update_data({'chain': None, 'chain_ref': None, 'chain_meta': None})  
     await message.answer('✍ Отправьте текст или файл цепочки сертификатов (.crt, .pem) или нажмите кнопку "Пропустить", если его нет', 
                          reply_markup=make_keyboard(SKIP_BUTTONS))
     
@@ -262,6 +371,40 @@ async def set_pw_reload(message: Message, state: FSMContext):
     await message.answer('✍ Укажите пароль для сертификата или нажмите кнопку "Пропустить", если его нет', 
                          reply_markup=make_keyboard(SKIP_BUTTONS))
     
+@dp.message(MyStates.setting_pw_state, Text(text='Шифрование'))
+async def set_profile_start(message: Message, state: FSMContext):
+    data = await state.get_data()
+    current = data.get('profile') or CONFIG.pkcs12_profile
+    # e.g. no "modern" with the OpenSSL 1.x CLI (no -iter)
+    usable = await asyncio.to_thread(ossl.usable_profiles, data.get('pw'))
+    # only the CLI can leave the certificates unencrypted
+    fast_certs = 'сертификаты не шифруются (только ключ)' \
+        if ossl.get_backend(None, data.get('pw'), ossl.PROFILES['fast']).name == 'cli' else 'шифруются ключ и сертификаты'
+    descriptions = {
+        'legacy-compatible': 'Совместимое - 3DES и SHA1, открывается старыми Java (до 8u301) и Windows (до 10 1709 / Server 2019)',
+        'modern': 'Современное - AES-256 и PBKDF2-SHA256 со 100000 итераций, устойчиво к подбору пароля, медленнее',
+        'fast': f'Быстрое - AES-256 с 2048 итерациями, {fast_certs}',
+        'default': 'По умолчанию - настройки OpenSSL / cryptography'}
+    buttons = [k for k, v in PROFILE_BUTTONS.items() if v in usable]
+    lines = ['🔐 Выберите шифрование .p12:'] + [f'• {descriptions[PROFILE_BUTTONS[k]]}' for k in buttons]
+    hidden = [k for k, v in PROFILE_BUTTONS.items() if v not in usable]
+    if hidden:
+        lines.append(f'Недоступно на этом сервере{" без пароля" if not data.get("pw") else ""}: {", ".join(hidden)}')
+    lines.append(f'Сейчас: {next((k for k, v in PROFILE_BUTTONS.items() if v == current), current)}')
+    await message.answer(ossl.NL.join(lines), reply_markup=make_keyboard(buttons))
+
+@dp.message(MyStates.setting_pw_state, Text(text=list(PROFILE_BUTTONS)))
+async def set_profile(message: Message, state: FSMContext):
+    data = await state.get_data()
+    try:
+        await asyncio.to_thread(ossl.check_profile, PROFILE_BUTTONS[message.text], data.get('pw'))
+    except Exception as err:
+        await message.answer(f'⛔ Шифрование "{message.text}" недоступно:{ossl.NL}{str(err)}',
+                             reply_markup=make_keyboard(PW_BUTTONS))
+        return
+    await state.update_data({'profile': PROFILE_BUTTONS[message.text]})
+    await message.answer(f'✅ Шифрование: {message.text}', reply_markup=make_keyboard(PW_BUTTONS))
+
 @dp.message(MyStates.setting_pw_state, F.text.regexp(r'[A-Za-z0-9\!\@\#\$\%\^\&\*\(\)\-\_\+\=\/\.\,\<\>\[\]\?\;\'\"]+'))
 async def set_pw_text(message: Message, state: FSMContext):
     # await state.set_state(MyStates.sending_priv_state)
@@ -273,31 +416,125 @@ async def set_pw_text(message: Message, state: FSMContext):
 
 @dp.message(MyStates.setting_pw_state, Text(text='Завершить'))
 async def make_p12(message: Message, state: FSMContext, bot: Bot):
+    data = await state.get_data()
+    key = data.get('priv', None)
+    alias = data.get('name', None)
+    pw = data.get('pw', None)
+    # logging.info(data)
+    try:
+        validate.check_bundle(data)
+    except ValidationError as err:
+        # caught on the cached metadata, before a conversion is spent
+        await message.answer(f'⛔ {str(err)}', reply_markup=make_keyboard(RESET_BUTTONS))
+        return
+    profile = data.get('profile') or CONFIG.pkcs12_profile
+    try:
+        # the password may have changed since the profile was chosen
+        await asyncio.to_thread(ossl.check_profile, profile, pw)
+    except Exception as err:
+        await message.answer(f'⛔ Выбранное шифрование недоступно, выберите другое:{ossl.NL}{str(err)}',
+                             reply_markup=make_keyboard(PW_BUTTONS))
+        return
+    await state.clear()
+    await state.set_state(MyStates.start_state)
     async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
-        data = await state.get_data()
-        cert = data.get('crt', None)
-        certchain = data.get('chain', None)
-        key = data.get('priv', None)
-        alias = data.get('name', None)
-        pw = data.get('pw', None)
-        # logging.info(data)
-        await state.clear()
-        await state.set_state(MyStates.start_state)
         try:
-            buf = ossl.make_pkcs12(cert, certchain, key, alias, pw)        
+            cert = await stored_pem(bot, data, 'crt')
+            certchain = await stored_pem(bot, data, 'chain')
+            buf = await convert(message, cert, certchain, key, alias, pw, normalized=validate.is_normalized(data),
+                                profile=profile)
+        except QueueFullError:
+            await message.answer('⏳ Сервер перегружен, попробуйте позже', 
+                                 reply_markup=make_keyboard(START_BUTTONS))
+            return
         except Exception as err:
             await message.answer(f'⛔ Ошибка генерации сертификата:{ossl.NL}{str(err)}', 
                                 reply_markup=ReplyKeyboardRemove())
             await message.answer(BOT_HELP, reply_markup=make_keyboard(START_BUTTONS))
             return
-        await message.answer_document(BufferedInputFile(buf, filename='cert.p12'), 
-                                    caption='🤲 Ваш сертификат готов',
-                                    reply_markup=ReplyKeyboardRemove())
+        with STAGE_UPLOAD.time():
+            await message.answer_document(BufferedInputFile(buf, filename='cert.p12'), 
+                                          caption='🤲 Ваш сертификат готов',
+                                          reply_markup=ReplyKeyboardRemove())
+
+# ================ 8 - ПАКЕТНЫЙ РЕЖИМ
+
+@dp.message(MyStates.start_state, Text(text='Пакет'))
+async def batch_start(message: Message, state: FSMContext):
+    await state.clear()
+    await state.set_state(MyStates.batch_state)
+    await message.answer('✍ Отправьте ZIP или TAR архив с сертификатами, приватными ключами и цепочками. '
+                         'Пароль для всех .p12 можно указать в подписи к архиву', 
+                         reply_markup=make_keyboard(BATCH_BUTTONS))
+
+@dp.message(MyStates.batch_state, F.document)
+async def batch_file(message: Message, state: FSMContext, bot: Bot):
+    try:
+        data, _ = await download_bytes(bot, message.document, CONFIG.max_archive_size)
+    except FileRejected as err:
+        await message.reply(f'⛔ {str(err)}', reply_markup=make_keyboard(BATCH_BUTTONS))
+        return
+    pw = message.caption.strip() if message.caption else None
+    async with ChatActionSender.upload_document(bot=bot, chat_id=message.chat.id):
+        try:
+            files = await asyncio.to_thread(batch.read_archive, data)
+            index = await asyncio.to_thread(batch.index_files, files)
+        except Exception as err:
+            await message.reply(f'⛔ Ошибка чтения архива:{ossl.NL}{str(err)}', 
+                                reply_markup=make_keyboard(BATCH_BUTTONS))
+            return
+        if not index.pairs:
+            await message.reply(f'⛔ Не найдено ни одной пары ключ + сертификат{ossl.NL}{ossl.NL}'
+                                f'{batch.make_report(index, [])}', 
+                                reply_markup=make_keyboard(BATCH_BUTTONS))
+            return
+        if len(index.pairs) > CONFIG.max_batch_queue:
+            await message.reply(f'⛔ В архиве {len(index.pairs)} пар ключ + сертификат, '
+                                f'за один раз можно не больше {CONFIG.max_batch_queue}', 
+                                reply_markup=make_keyboard(BATCH_BUTTONS))
+            return
+        try:
+            jobs = get_scheduler().submit_batch(message.from_user.id, ossl.make_pkcs12, 
+                                                [batch.pair_args(p, pw) for p in index.pairs])
+        except QueueFullError:
+            await message.answer('⏳ Сервер перегружен, попробуйте позже', 
+                                 reply_markup=make_keyboard(BATCH_BUTTONS))
+            return
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        archive = await asyncio.to_thread(batch.make_archive, index, results)
+    await state.set_state(MyStates.start_state)
+    done = sum(1 for r in results if isinstance(r, bytes))
+    with STAGE_UPLOAD.time():
+        await message.answer_document(BufferedInputFile(archive, filename='certs.zip'), 
+                                      caption=f'🤲 Готово: {done} из {len(index.pairs)}, '
+                                              f'без пары: ключей {len(index.unmatched_keys)}, '
+                                              f'сертификатов {len(index.unmatched_certs)} (см. report.txt)',
+                                      reply_markup=make_keyboard(START_BUTTONS))
 
 # ============================================================ #
 
-async def main():
-    await dp.start_polling(bot, skip_updates=True)
+async def main(set_webhook: bool = True):
+    # a wrong PKCS12_BACKEND / PKCS12_PROFILE fails here, not at the first export
+    ossl.get_backend()
+    # probe OpenSSL once at startup, later calls read the cached capabilities
+    await asyncio.to_thread(ossl.check_ossl)
+    # a configured profile it cannot run fails here too (exports without a password are checked per request)
+    await asyncio.to_thread(ossl.get_backend().check_profile, ossl.get_profile())
+    await asyncio.to_thread(ossl.cleanup_spool)
+    metrics_runner = await serve_metrics()
+    try:
+        if CONFIG.webhook_url:
+            await webhook.serve(dp, bot, set_webhook)
+        else:
+            await dp.start_polling(bot, skip_updates=True)
+    finally:
+        get_scheduler().shutdown()
+        ossl.close_pool()
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if CONFIG.webhook_url and CONFIG.webhook_workers > 1:
+        webhook.run_workers(partial(main, False), bot, CONFIG.webhook_workers)
+    else:
+        asyncio.run(main())
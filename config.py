@@ -4,6 +4,55 @@ class Settings(BaseSettings):
     bot_token: SecretStr
     openssl_root: str
     temp_dir: str
+    spool_dir: str = None
+    max_jobs: int = 2
+    max_queue: int = 100
+    max_user_queue: int = 5
+    max_batch_queue: int = 1000
+    ossl_caps_ttl: int = 3600
+    ossl_timeout: float = 30
+    ossl_pool_size: int = 0
+    ossl_health_interval: float = 60
+    worker_socket: str = None
+    worker_procs: int = 0
+    worker_queue: int = 100
+    worker_batch: int = 8
+    worker_timeout: float = 60
+    max_file_size: int = 1024 * 1024
+    max_downloads: int = 10
+    max_archive_size: int = 10 * 1024 * 1024
+    batch_max_files: int = 500
+    batch_max_unpacked: int = 50 * 1024 * 1024
+    fsm_storage: str = 'memory'
+    fsm_ttl: int = 3600
+    fsm_max_bytes: int = 64 * 1024 * 1024
+    fsm_db: str = None
+    webhook_url: str = None
+    webhook_host: str = '0.0.0.0'
+    webhook_port: int = 8080
+    webhook_path: str = '/webhook'
+    webhook_secret: SecretStr = None
+    webhook_cert: str = None
+    webhook_key: str = None
+    webhook_upload_cert: bool = False
+    webhook_max_connections: int = 40
+    webhook_workers: int = 1
+    webhook_reuse_port: bool = False
+    http_pool_limit: int = 100
+    http_keepalive: float = 60
+    pkcs12_backend: str = 'auto'
+    pkcs12_profile: str = 'default'
+    metrics_host: str = '127.0.0.1'
+    metrics_port: int = None
+    file_cache_bytes: int = 16 * 1024 * 1024
+    file_cache_ttl: float = 3600
+    rate_limit: bool = True
+    rate_global: float = 30
+    rate_chat: float = 1
+    rate_group: float = 20 / 60
+    rate_burst: float = 3
+    rate_action_stale: float = 1.0
+    rate_retries: int = 3
 
     class Config:
         env_file = '.env'
@@ -0,0 +1,206 @@
+"""
+Content-addressed cache of uploaded certificates and chains. The text of a
+file is kept once per SHA-256 and found by Telegram's file_unique_id without
+getFile / download; the parsed certificates and the upload check results
+are kept with it. The FSM state of every user holding the same file only
+keeps a reference (see reference / resolve), so identical chains share one
+copy. Private keys are never cached.
+"""
+import asyncio, hashlib, time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.types import Document
+
+from config import CONFIG
+import files
+import metrics
+import validate
+
+# ============================================================ #
+
+# any PEM private key label: PRIVATE KEY, RSA / EC PRIVATE KEY, ENCRYPTED PRIVATE KEY
+KEY_MARKER = 'PRIVATE KEY'
+
+LOOKUPS = metrics.Counter('file_cache_lookups_total', 'File cache lookups', ['kind', 'result'])
+UPLOAD_HIT, UPLOAD_MISS = LOOKUPS.labels('upload', 'hit'), LOOKUPS.labels('upload', 'miss')
+RESULT_HIT, RESULT_MISS = LOOKUPS.labels('result', 'hit'), LOOKUPS.labels('result', 'miss')
+REF_HIT, REF_MISS = LOOKUPS.labels('reference', 'hit'), LOOKUPS.labels('reference', 'miss')
+
+# ============================================================ #
+
+class CacheEntry:
+    __slots__ = ('text', 'results')
+
+    def __init__(self, text: str):
+        self.text = text
+        # result key -> (value, expires as a unix time)
+        self.results: dict[str, tuple] = {}
+
+class FileCache:
+    """
+    LRU of file texts within a byte budget, keyed by the SHA-256 of the text.
+    Not thread safe: use it from the event loop only.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, result_ttl: float = 3600):
+        self.max_bytes = max_bytes
+        self.result_ttl = result_ttl
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        # file_unique_id -> digest of the downloaded text
+        self._uploads: dict[str, str] = {}
+        # file_unique_id -> download in progress, shared by everyone sending the same file at once
+        self.downloads: dict[str, asyncio.Future] = {}
+        self._bytes = 0
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    @property
+    def count(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def put(self, text: str) -> Optional[str]:
+        """
+        Store a text (or find the identical one) and return its digest;
+        None for anything holding a private key, which is never stored.
+        """
+        if KEY_MARKER in text:
+            return None
+        digest = self.digest(text)
+        if digest in self._entries:
+            self._entries.move_to_end(digest)
+        else:
+            self._entries[digest] = CacheEntry(text)
+            self._bytes += len(text)
+            self._evict()
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        self._entries.move_to_end(digest)
+        return entry.text
+
+    def upload(self, unique_id: str) -> Optional[str]:
+        digest = self._uploads.get(unique_id)
+        if digest is not None and digest not in self._entries:
+            # the text was evicted
+            del self._uploads[unique_id]
+            digest = None
+        return digest
+
+    def add_upload(self, unique_id: str, text: str) -> Optional[str]:
+        digest = self.put(text)
+        if digest is not None:
+            self._uploads[unique_id] = digest
+        return digest
+
+    def result(self, digest: str, key: str) -> Any:
+        entry = self._entries.get(digest)
+        value, expires = entry.results.get(key, (None, 0)) if entry else (None, 0)
+        if value is not None and expires <= time.time():
+            del entry.results[key]
+            value = None
+        (RESULT_MISS if value is None else RESULT_HIT).inc()
+        return value
+
+    def store_result(self, digest: str, key: str, value: Any, expires: float = None) -> Any:
+        entry = self._entries.get(digest)
+        if entry is not None:
+            ttl = time.time() + self.result_ttl
+            entry.results[key] = (value, ttl if expires is None else min(ttl, expires))
+        return value
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= len(entry.text)
+        if len(self._uploads) > 4 * len(self._entries) + 1000:
+            self._uploads = {k: d for k, d in self._uploads.items() if d in self._entries}
+
+CACHE: FileCache = None
+
+def get_cache() -> FileCache:
+    global CACHE
+    if CACHE is None:
+        CACHE = FileCache(CONFIG.file_cache_bytes, CONFIG.file_cache_ttl)
+    return CACHE
+
+metrics.Gauge('file_cache_bytes', 'Text held by the file cache', func=lambda: CACHE.size if CACHE else 0)
+
+# ================ UPLOADS
+
+async def download_document(bot: Bot, document: Document, label: str = 'CERTIFICATE') -> tuple[str, Optional[str]]:
+    """
+    files.download_document through the cache: (text, digest), the digest
+    is None if the text could not be cached.
+    """
+    cache = get_cache()
+    unique_id = document.file_unique_id
+    digest = cache.upload(unique_id)
+    if digest is not None:
+        UPLOAD_HIT.inc()
+        return cache.get(digest), digest
+    task = cache.downloads.get(unique_id)
+    if task is None:
+        UPLOAD_MISS.inc()
+        task = cache.downloads[unique_id] = asyncio.ensure_future(files.download_document(bot, document, label))
+        task.add_done_callback(lambda _: cache.downloads.pop(unique_id, None))
+    else:
+        UPLOAD_HIT.inc()
+    # shielded: one user giving up must not cancel the download for the others
+    text = await asyncio.shield(task)
+    return text, cache.add_upload(unique_id, text)
+
+def result_key(name: str, *context) -> str:
+    # a check result depends on the file and on what it was checked against
+    return FileCache.digest('\0'.join(map(str, (name, *context))))
+
+async def parsed_certs(digest: str, text: str) -> Optional[list]:
+    """
+    The certificates of a cached file, parsed once; None if they cannot be
+    parsed (the check itself will parse again and report why).
+    """
+    cache = get_cache()
+    infos = cache.result(digest, 'certs')
+    if infos is None:
+        try:
+            infos = await asyncio.to_thread(validate.parse_certs, text, 'pem')
+        except Exception:
+            return None
+        cache.store_result(digest, 'certs', infos)
+    return infos
+
+# ================ FSM REFERENCES
+
+def reference(pem: str, document: Document) -> Optional[dict]:
+    """
+    Put the checked PEM of an uploaded file into the cache and return the
+    reference to keep in the FSM state instead of the text (None = keep the text).
+    """
+    digest = get_cache().put(pem)
+    if digest is None:
+        return None
+    return {'sha256': digest, 'file_id': document.file_id, 'file_unique_id': document.file_unique_id}
+
+async def resolve(bot: Bot, ref: dict, label: str = 'CERTIFICATE') -> tuple[str, bool]:
+    """
+    The text behind a reference: (text, normalized). If it was evicted (or
+    cached by another worker process) the original file is downloaded again
+    by its file_id, that text is not normalized.
+    """
+    text = get_cache().get(ref['sha256'])
+    if text is not None:
+        REF_HIT.inc()
+        return text, True
+    REF_MISS.inc()
+    document = Document(file_id=ref['file_id'], file_unique_id=ref['file_unique_id'])
+    return await files.download_document(bot, document, label), False
@@ -0,0 +1,130 @@
+import asyncio, time
+from typing import Optional, Callable
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import Document
+
+from config import CONFIG
+import ossl
+import metrics
+
+# ============================================================ #
+
+CHUNK_SIZE = 16384
+STAGE_DOWNLOAD = metrics.stage('download')
+DOWNLOAD_TIMEOUTS = metrics.TIMEOUTS.labels('download')
+DOWNLOAD_REJECTED = metrics.Counter('downloads_rejected_total', 'Uploads rejected by size or format')
+
+# ============================================================ #
+
+class FileRejected(Exception):
+    pass
+
+class PooledSession(AiohttpSession):
+    """
+    One keep-alive aiohttp session for all Bot API calls and file transfers,
+    with a tuned connection pool and a cap on concurrent file downloads.
+    """
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 60, max_transfers: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self._connector_init.update(limit=limit, limit_per_host=limit, keepalive_timeout=keepalive_timeout,
+                                    ttl_dns_cache=300, enable_cleanup_closed=True)
+        self.max_transfers = max_transfers
+        self._transfers: Optional[asyncio.Semaphore] = None
+
+    @property
+    def transfers(self) -> asyncio.Semaphore:
+        # created lazily to bind to the running event loop
+        if self._transfers is None:
+            self._transfers = asyncio.Semaphore(self.max_transfers)
+        return self._transfers
+
+def make_session() -> PooledSession:
+    return PooledSession(CONFIG.http_pool_limit, CONFIG.http_keepalive, CONFIG.max_downloads)
+
+def check_size(size: Optional[int], max_size: int):
+    if size and size > max_size:
+        raise FileRejected(f'Файл слишком большой ({size // 1024} КБ), максимум {max_size // 1024} КБ')
+
+async def _local_chunks(path: str):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+async def download_bytes(bot: Bot, document: Document, max_size: int = None,
+                         sniff: Callable[[bytes, bool], Optional[str]] = None) -> tuple[bytes, Optional[str]]:
+    """
+    Stream a document into memory and return (data, format).
+    The file is rejected by its declared size before any request is made,
+    and while streaming as soon as the size limit is exceeded or `sniff`
+    rejects the first bytes (it returns a format, None to wait for more data
+    or raises).
+    """
+    start = time.perf_counter()
+    try:
+        data, fmt = await _download(bot, document, max_size or CONFIG.max_file_size, sniff)
+    except FileRejected:
+        DOWNLOAD_REJECTED.inc()
+        raise
+    except asyncio.TimeoutError:
+        DOWNLOAD_TIMEOUTS.inc()
+        raise
+    STAGE_DOWNLOAD.observe(time.perf_counter() - start)
+    return data, fmt
+
+async def _download(bot: Bot, document: Document, max_size: int,
+                    sniff: Optional[Callable[[bytes, bool], Optional[str]]]) -> tuple[bytes, Optional[str]]:
+    check_size(document.file_size, max_size)
+
+    file = await bot.get_file(document.file_id)
+    check_size(file.file_size, max_size)
+
+    session = bot.session
+    if session.api.is_local:
+        stream = _local_chunks(str(session.api.wrap_local_file.to_local(file.file_path)))
+    else:
+        stream = session.stream_content(url=session.api.file_url(bot.token, file.file_path),
+                                        timeout=30, chunk_size=CHUNK_SIZE, raise_for_status=True)
+    transfers = getattr(session, 'transfers', None)
+
+    buf = bytearray()
+    fmt = None
+    if transfers: await transfers.acquire()
+    try:
+        async for chunk in stream:
+            buf += chunk
+            check_size(len(buf), max_size)
+            if sniff and fmt is None:
+                fmt = sniff(bytes(buf[:ossl.SNIFF_LIMIT]), False)
+        if sniff and fmt is None:
+            fmt = sniff(bytes(buf), True)
+    finally:
+        if transfers: transfers.release()
+        # stops the transfer if we bailed out early
+        await stream.aclose()
+    return bytes(buf), fmt
+
+def sniff_pem_der(head: bytes, final: bool) -> Optional[str]:
+    try:
+        return ossl.sniff_format(head, final)
+    except Exception:
+        raise FileRejected('Файл не похож на PEM или DER')
+
+async def download_document(bot: Bot, document: Document, label: str = 'CERTIFICATE',
+                            max_size: int = None) -> str:
+    """
+    Download a PEM / DER document sent by the user and return it as PEM text.
+    """
+    data, fmt = await download_bytes(bot, document, max_size, sniff_pem_der)
+    if fmt == ossl.FORMAT_DER:
+        data = ossl.der_to_pem(data, label)
+    try:
+        # utf-8-sig drops a BOM some editors put in front of "-----BEGIN"
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise FileRejected('Файл не похож на PEM или DER')
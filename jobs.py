@@ -0,0 +1,200 @@
+import asyncio, logging, time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Hashable
+
+from config import CONFIG
+import metrics
+
+# ============================================================ #
+
+QUEUE_WAIT = metrics.stage('queue_wait')
+JOB_RUN = metrics.stage('job')
+REJECTED = metrics.Counter('jobs_rejected_total', 'Jobs refused because a queue was full')
+
+# ============================================================ #
+
+class QueueFullError(Exception):
+    pass
+
+class Job:
+
+    def __init__(self, user: Hashable, func: Callable, args: tuple, kwargs: dict):
+        self.user = user
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # 0 = started immediately, N = N-th in line when submitted
+        self.position = 0
+        self.submitted = time.perf_counter()
+        self.started = 0.0
+
+    def __await__(self):
+        return self.future.__await__()
+
+class JobScheduler:
+    """
+    Bounded job scheduler: at most `max_jobs` blocking jobs run concurrently
+    in a thread pool, pending jobs are queued per user and dispatched round-robin,
+    so a single user with many exports cannot starve the others. Batch jobs
+    wait in a backlog of their own (up to `max_batch_queue`) and enter their
+    user's queue a few at a time, like ordinary jobs.
+    """
+
+    def __init__(self, max_jobs: int = 2, max_queue: int = 100, max_user_queue: int = 5,
+                 max_batch_queue: int = 1000):
+        self.max_jobs = max_jobs
+        self.max_queue = max_queue
+        self.max_user_queue = max_user_queue
+        self.max_batch_queue = max_batch_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='ossl')
+        self._queues: OrderedDict[Hashable, deque[Job]] = OrderedDict()
+        self._backlog: dict[Hashable, deque[Job]] = {}
+        self._running = 0
+        self._pending = 0
+        self._batched = 0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def batched(self) -> int:
+        return self._batched
+
+    def submit(self, user: Hashable, func: Callable, *args, **kwargs) -> Job:
+        job = Job(user, func, args, kwargs)
+        if self._running < self.max_jobs and not self._pending:
+            self._start(job)
+            return job
+        if self._pending >= self.max_queue:
+            REJECTED.inc()
+            raise QueueFullError('Job queue is full, try again later')
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = self._queues[user] = deque()
+        elif len(queue) >= self.max_user_queue:
+            REJECTED.inc()
+            raise QueueFullError('Too many pending jobs for this user')
+        queue.append(job)
+        self._pending += 1
+        job.position = self.position(job)
+        return job
+
+    def submit_batch(self, user: Hashable, func: Callable, args_list: list[tuple]) -> list[Job]:
+        """
+        Submit many jobs of one user at once (batch mode). They do not take the
+        shared queue: at most `max_user_queue` of them wait there at a time and
+        take turns with other users' jobs, the rest wait in the batch backlog.
+        """
+        if self._batched + len(args_list) > self.max_batch_queue:
+            REJECTED.inc(len(args_list))
+            raise QueueFullError('Batch queue is full, try again later')
+        jobs = [Job(user, func, args, {}) for args in args_list]
+        self._backlog.setdefault(user, deque()).extend(jobs)
+        self._batched += len(jobs)
+        self._feed(user)
+        return jobs
+
+    async def run(self, user: Hashable, func: Callable, *args, **kwargs) -> Any:
+        return await self.submit(user, func, *args, **kwargs)
+
+    def position(self, job: Job) -> int:
+        # simulate round-robin dispatch over a snapshot of the per-user queues
+        queues = [list(q) for q in self._queues.values()]
+        pos, depth = 0, 0
+        while any(depth < len(q) for q in queues):
+            for q in queues:
+                if depth < len(q):
+                    pos += 1
+                    if q[depth] is job:
+                        return pos
+            depth += 1
+        return 0
+
+    def shutdown(self):
+        for queue in (*self._queues.values(), *self._backlog.values()):
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._backlog.clear()
+        self._pending = 0
+        self._batched = 0
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _start(self, job: Job):
+        self._running += 1
+        job.started = time.perf_counter()
+        QUEUE_WAIT.observe(job.started - job.submitted)
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._executor, partial(job.func, *job.args, **job.kwargs))
+        fut.add_done_callback(partial(self._done, job))
+
+    def _done(self, job: Job, fut: asyncio.Future):
+        self._running -= 1
+        JOB_RUN.observe(time.perf_counter() - job.started)
+        if not job.future.done():
+            if fut.cancelled():
+                job.future.cancel()
+            elif fut.exception() is not None:
+                job.future.set_exception(fut.exception())
+            else:
+                job.future.set_result(fut.result())
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._running < self.max_jobs and self._queues:
+            user, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            self._pending -= 1
+            if queue:
+                # user goes to the back of the line with the rest of their jobs
+                self._queues[user] = queue
+            if job.future.cancelled():
+                continue
+            try:
+                self._start(job)
+            except Exception as err:
+                logging.exception(err)
+                self._running -= 1
+                job.future.set_exception(err)
+        for user in list(self._backlog):
+            self._feed(user)
+
+    def _feed(self, user: Hashable):
+        # move batch jobs of `user` from the backlog to their queue while it has room
+        backlog = self._backlog[user]
+        while backlog:
+            job = backlog[0]
+            if not job.future.cancelled():
+                if self._running < self.max_jobs and not self._pending:
+                    self._start(job)
+                else:
+                    queue = self._queues.get(user)
+                    if self._pending >= self.max_queue or (queue and len(queue) >= self.max_user_queue):
+                        break
+                    self._queues.setdefault(user, deque()).append(job)
+                    self._pending += 1
+            backlog.popleft()
+            self._batched -= 1
+        if not backlog:
+            del self._backlog[user]
+
+SCHEDULER: JobScheduler = None
+
+def get_scheduler() -> JobScheduler:
+    global SCHEDULER
+    if SCHEDULER is None:
+        SCHEDULER = JobScheduler(CONFIG.max_jobs, CONFIG.max_queue, CONFIG.max_user_queue, CONFIG.max_batch_queue)
+    return SCHEDULER
+
+# queue depth is read from the scheduler when scraped, nothing is updated per job
+metrics.Gauge('jobs_running', 'Conversion jobs running now', func=lambda: SCHEDULER.running if SCHEDULER else 0)
+metrics.Gauge('jobs_pending', 'Conversion jobs waiting in the queue', func=lambda: SCHEDULER.pending if SCHEDULER else 0)
+metrics.Gauge('jobs_batched', 'Batch jobs waiting in the batch backlog', func=lambda: SCHEDULER.batched if SCHEDULER else 0)
@@ -0,0 +1,64 @@
+import asyncio, logging, time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import CONFIG
+import metrics
+
+# ============================================================ #
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Times every handler call and counts the ones that raised,
+    labelled by the handler function name.
+    """
+
+    def __init__(self):
+        self._bound: Dict[str, tuple] = {}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_obj = data.get('handler')
+        name = handler_obj.callback.__name__ if handler_obj else 'unknown'
+        bound = self._bound.get(name)
+        if bound is None:
+            bound = self._bound[name] = (metrics.HANDLER_SECONDS.labels(name), metrics.HANDLER_ERRORS.labels(name))
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            bound[1].inc()
+            raise
+        finally:
+            bound[0].observe(time.perf_counter() - start)
+
+# ================ PROMETHEUS ENDPOINT
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    # off the event loop: the temp_dir_bytes / spool_bytes gauges walk directories
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return web.Response(body=body.encode('utf-8'),
+                        headers={'Content-Type': metrics.CONTENT_TYPE})
+
+def make_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    return app
+
+async def serve_metrics(host: str = None, port: int = None) -> Optional[web.AppRunner]:
+    """
+    Start the /metrics endpoint (local only by default) if METRICS_PORT is set;
+    the caller cleans the returned runner up.
+    """
+    host = host or CONFIG.metrics_host
+    port = port or CONFIG.metrics_port
+    if not port:
+        return None
+    runner = web.AppRunner(make_app(), handle_signals=False, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f'Metrics endpoint on http://{host}:{port}/metrics')
+    return runner
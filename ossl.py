@@ -1,9 +1,25 @@
 import subprocess as sp
-import platform, os, traceback, logging, io, uuid
+import platform, os, traceback, logging, io, uuid, re, time, shutil, threading, hashlib, base64, atexit
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Union
+from typing import Union, Optional, NamedTuple
 
 from config import CONFIG
+from osslpool import OsslPool, SessionError, SessionTimeout
+import metrics
+
+try:
+    import cryptography
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    # the RSA consistency check costs tens of ms and is not needed just to read the public key
+    SKIP_RSA_CHECK = {'unsafe_skip_rsa_key_validation': True} \
+        if int(cryptography.__version__.split('.')[0]) >= 39 else {}
+except ImportError:
+    x509 = hashes = serialization = pkcs12 = None
 
 # ============================================================ #
 
@@ -16,10 +32,39 @@ PEM_END = '-----END'
 NL = '\n'
 PemType = Union[str, io.BytesIO, bytes, None]
 
+STAGE_PROBE = metrics.stage('probe_openssl')
+STAGE_PEM = metrics.stage('process_pem')
+STAGE_PKCS12 = metrics.stage('pkcs12')
+STAGE_READ = metrics.stage('read_output')
+STAGE_CONVERT = metrics.stage('convert')
+OSSL_TIMEOUTS = metrics.TIMEOUTS.labels('openssl')
+
 # ============================================================ #
 
+def _command(args) -> str:
+    # openssl subcommand for the metric labels: "pkcs12", "x509", ...
+    if isinstance(args, str):
+        args = args.split()
+    return str(args[1]) if len(args) > 1 else 'openssl'
+
 def run_exe(args, external=False, capture_output=True, stdout=sp.PIPE, encoding=ENC,
-            timeout=None, shell=False, **kwargs):    
+            timeout=None, shell=False, pooled=False, **kwargs):    
+    if pooled and not external and not kwargs:
+        pool = get_pool()
+        if pool:
+            # args[0] is the openssl binary itself, the session gets the rest
+            try:
+                ok, out = pool.execute(args[1:], timeout)
+            except SessionError as err:
+                if isinstance(err, SessionTimeout):
+                    OSSL_TIMEOUTS.inc()
+                metrics.OSSL_FAILURES.labels(_command(args)).inc()
+                raise sp.SubprocessError(str(err))
+            if not ok:
+                metrics.OSSL_FAILURES.labels(_command(args)).inc()
+            return sp.CompletedProcess(args, 0 if ok else 1,
+                                       out.decode(encoding, 'replace') if encoding else out,
+                                       '' if encoding else b'')
     if external:
         if OSPLATFORM == 'Windows':
             creationflags=sp.CREATE_NO_WINDOW | sp.DETACHED_PROCESS
@@ -35,8 +80,16 @@ def run_exe(args, external=False, capture_output=True, stdout=sp.PIPE, encoding=
                 encoding=encoding, shell=shell, preexec_fn=os.setpgrp,
                 **kwargs)
     else:
-        return sp.run(args, capture_output=capture_output, encoding=encoding,
-                        timeout=timeout, shell=shell, **kwargs)
+        try:
+            res = sp.run(args, capture_output=capture_output, encoding=encoding,
+                         timeout=timeout, shell=shell, **kwargs)
+        except sp.TimeoutExpired:
+            OSSL_TIMEOUTS.inc()
+            metrics.OSSL_FAILURES.labels(_command(args)).inc()
+            raise
+        if res.returncode:
+            metrics.OSSL_FAILURES.labels(_command(args)).inc()
+        return res
     
 def generate_uid():
     return uuid.uuid4().hex
@@ -44,83 +97,800 @@ def generate_uid():
 def check_ossl_path():
     return Path(CONFIG.openssl_root).exists()
 
+# ================ OPENSSL CAPABILITIES
+
+@dataclass(frozen=True)
+class OsslCaps:
+    exe: str
+    mtime: float
+    probed: float
+    version: str
+    version_info: tuple
+    pkcs12_options: frozenset
+
+    @property
+    def interactive(self) -> bool:
+        # the interactive "OpenSSL>" prompt was dropped in 3.0
+        return self.version_info < (3,)
+
+    def supports(self, option: str) -> bool:
+        return option in self.pkcs12_options
+
+_CAPS: Optional[OsslCaps] = None
+_CAPS_LOCK = threading.Lock()
+RE_VERSION = re.compile(r'^\S+\s+(\d+)\.(\d+)\.(\d+)')
+RE_OPTION = re.compile(r'^\s*(-[\w-]+)', re.M)
+
+def find_ossl_exe() -> Optional[str]:
+    return shutil.which(str(SSLEXE)) if check_ossl_path() else None
+
+def probe_ossl(exe: str, mtime: float) -> OsslCaps:
+    res = run_exe([exe, 'version'])
+    res.check_returncode()
+    version = res.stdout.strip()
+    m = RE_VERSION.match(version)
+    version_info = tuple(int(x) for x in m.groups()) if m else ()
+    # "-help" prints the usage to stderr and may exit with non-zero code in 1.x
+    res = run_exe([exe, 'pkcs12', '-help'])
+    usage = (res.stdout or '') + (res.stderr or '')
+    options = frozenset(RE_OPTION.findall(usage))
+    return OsslCaps(exe, mtime, time.monotonic(), version, version_info, options)
+
+def _caps_fresh(caps: Optional[OsslCaps]) -> bool:
+    if caps is None or time.monotonic() - caps.probed >= CONFIG.ossl_caps_ttl:
+        return False
+    try:
+        # a single stat() instead of a fork/exec of "openssl version"
+        return os.stat(caps.exe).st_mtime == caps.mtime
+    except OSError:
+        return False
+
+def get_caps(force: bool = False) -> OsslCaps:
+    global _CAPS
+    if not force and _caps_fresh(_CAPS):
+        return _CAPS
+    with _CAPS_LOCK:
+        if force or not _caps_fresh(_CAPS):
+            exe = find_ossl_exe()
+            if not exe:
+                _CAPS = None
+                raise Exception('OpenSSL path not found or invalid')
+            with STAGE_PROBE.time():
+                _CAPS = probe_ossl(exe, os.stat(exe).st_mtime)
+            logging.info(f'OpenSSL probed: {_CAPS.version}')
+        return _CAPS
+
+# ================ OPENSSL SESSION POOL
+
+_POOL: Optional[OsslPool] = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool() -> Optional[OsslPool]:
+    """
+    Return the pool of interactive OpenSSL sessions or None if pooling is disabled
+    (CONFIG.ossl_pool_size = 0) or unsupported (OpenSSL 3.x, Windows).
+    """
+    global _POOL
+    if CONFIG.ossl_pool_size <= 0 or OSPLATFORM == 'Windows':
+        return None
+    caps = get_caps()
+    if not caps.interactive:
+        return None
+    if _POOL is None or _POOL.exe != caps.exe:
+        with _POOL_LOCK:
+            if _POOL is None or _POOL.exe != caps.exe:
+                if _POOL: _POOL.close()
+                _POOL = OsslPool(caps.exe, CONFIG.ossl_pool_size, CONFIG.ossl_timeout,
+                                 CONFIG.ossl_health_interval)
+    return _POOL
+
+def close_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL: _POOL.close()
+        _POOL = None
+
 def check_ossl():
     try:
-        if not check_ossl_path():
-            raise Exception('OpenSSL path not found or invalid')
-        res = run_exe([SSLEXE, 'version'])
-        res.check_returncode()
-        return res.stdout
+        return get_caps().version
     except:
         logging.exception(traceback.format_exc())
         return None
     
-def process_pem(pem: PemType, filename: str) -> Path:
+# ================ PEM / DER FORMAT
+
+FORMAT_PEM = 'pem'
+FORMAT_DER = 'der'
+SNIFF_LIMIT = 8192
+BOM = b'\xef\xbb\xbf'
+
+def sniff_format(head: bytes, final: bool = False) -> Optional[str]:
+    """
+    Detect PEM or DER from the first bytes of a file.
+    Returns FORMAT_PEM / FORMAT_DER, None if more bytes are needed
+    or raises an Exception if the data is neither.
+    """
+    if head.startswith(BOM):
+        head = head[len(BOM):]
+    if head[:1] == b'\x30' and len(head) >= 2:
+        # DER SEQUENCE with short or 1-4 byte long form length
+        if head[1] < 0x80 or 0x81 <= head[1] <= 0x84:
+            return FORMAT_DER
+    start = PEM_START.encode()
+    pos = head.find(start)
+    # PEM may be preceded by text such as "Bag Attributes" or "openssl x509 -text" output
+    preamble = head if pos < 0 else head[:pos]
+    if not all(32 <= b < 127 or b in b'\t\n\r' for b in preamble):
+        raise Exception('File is neither PEM nor DER')
+    if pos >= 0:
+        return FORMAT_PEM
+    if final or len(head) >= SNIFF_LIMIT:
+        raise Exception('File is neither PEM nor DER')
+    return None
+
+def der_to_pem(der: bytes, label: str) -> bytes:
+    b64 = base64.b64encode(der)
+    lines = [b64[i:i + 64] for i in range(0, len(b64), 64)]
+    return b''.join([f'{PEM_START} {label}-----{NL}'.encode(), *(l + NL.encode() for l in lines),
+                     f'{PEM_END} {label}-----{NL}'.encode()])
+
+def pem_to_bytes(pem: PemType, filename: str) -> bytes:
     if pem is None:
         raise Exception(f'PEM file "{filename}" is NULL')
     if isinstance(pem, io.BytesIO):
-        pem = pem.getvalue().decode(ENC)
-    elif isinstance(pem, bytes):
-        pem = pem.decode(ENC)
-    elif not isinstance(pem, str):
-        raise Exception(f'Wrong PEM format in file "{filename}"')
+        return pem.getvalue()
+    if isinstance(pem, str):
+        return pem.encode(ENC)
+    if isinstance(pem, bytes):
+        return pem
+    raise Exception(f'Wrong PEM format in file "{filename}"')
+
+# ================ PEM PARSER
+
+KIND_CERT = 'cert'
+KIND_KEY = 'key'
+KIND_CSR = 'csr'
+KIND_CRL = 'crl'
+KIND_PUBKEY = 'pubkey'
+KIND_OTHER = 'other'
+PEM_KINDS = {
+    b'CERTIFICATE': KIND_CERT, b'X509 CERTIFICATE': KIND_CERT, b'TRUSTED CERTIFICATE': KIND_CERT,
+    b'PRIVATE KEY': KIND_KEY, b'ENCRYPTED PRIVATE KEY': KIND_KEY, b'RSA PRIVATE KEY': KIND_KEY,
+    b'EC PRIVATE KEY': KIND_KEY, b'DSA PRIVATE KEY': KIND_KEY,
+    b'CERTIFICATE REQUEST': KIND_CSR, b'NEW CERTIFICATE REQUEST': KIND_CSR,
+    b'X509 CRL': KIND_CRL, b'PUBLIC KEY': KIND_PUBKEY, b'RSA PUBLIC KEY': KIND_PUBKEY,
+}
+_BEGIN = b'-----BEGIN '
+_END = b'-----END '
+_DASHES = b'-----'
+_B64_LINE = 64
+
+class PemBlock(NamedTuple):
+    kind: str
+    label: str
+    # span of the whole block in the source buffer, BEGIN / END lines included
+    start: int
+    end: int
+    # span of the body (base64, for DER - the raw bytes)
+    body_start: int
+    body_end: int
+    der: bool = False
+
+def parse_pem(data: Union[bytes, bytearray, memoryview], der_label: str = 'CERTIFICATE') -> list[PemBlock]:
+    """
+    Split a PEM bundle into typed blocks in one forward pass without copying
+    the data: the blocks only hold offsets into `data`. A DER input is
+    returned as a single block labelled `der_label`.
+    """
+    if isinstance(data, memoryview):
+        data = data.obj if data.contiguous and isinstance(data.obj, (bytes, bytearray)) \
+            and len(data) == len(data.obj) else data.tobytes()
+    fmt = sniff_format(data[:SNIFF_LIMIT], final=True) if data else None
+    if fmt == FORMAT_DER:
+        return [PemBlock(PEM_KINDS.get(der_label.encode(), KIND_OTHER), der_label, 0, len(data), 0, len(data), True)]
+
+    blocks = []
+    pos = 0
+    while True:
+        start = data.find(_BEGIN, pos)
+        if start < 0:
+            break
+        label_start = start + len(_BEGIN)
+        label_end = data.find(_DASHES, label_start)
+        if label_end < 0 or b'\n' in data[label_start:label_end]:
+            raise Exception(f'Malformed PEM header at offset {start}')
+        label = data[label_start:label_end]
+        body_start = label_end + len(_DASHES)
+        end_marker = _END + label + _DASHES
+        body_end = data.find(end_marker, body_start)
+        if body_end < 0:
+            raise Exception(f'PEM block "{label.decode(ENC, "replace")}" at offset {start} is not terminated')
+        if data.find(_BEGIN, body_start, body_end) >= 0:
+            raise Exception(f'PEM block "{label.decode(ENC, "replace")}" at offset {start} contains another block')
+        end = body_end + len(end_marker)
+        blocks.append(PemBlock(PEM_KINDS.get(label, KIND_OTHER), label.decode(ENC, 'replace'),
+                               start, end, body_start, body_end))
+        pos = end
+    return blocks
 
-    lines_pem = [l.strip() for l in pem.splitlines() if l.strip()]
-    if len(lines_pem) < 3 or not (lines_pem[0].startswith(PEM_START) and lines_pem[-1].startswith(PEM_END)):
+def block_der(data: bytes, block: PemBlock) -> bytes:
+    if block.der:
+        return bytes(data[block.body_start:block.body_end])
+    body = data[block.body_start:block.body_end]
+    if b':' in body:
+        # RFC 1421 headers (Proc-Type, DEK-Info) of legacy encrypted keys
+        raise Exception(f'Encrypted PEM block "{block.label}" has no plain DER form')
+    return base64.b64decode(b''.join(body.split()))
+
+def _is_wrapped(body: bytes) -> bool:
+    # already canonical: "\n" + 64-char lines + "\n", i.e. every 65th byte and only those are line breaks
+    n = len(body)
+    return n > 2 and body.count(b'\n') == (n - 2) // (_B64_LINE + 1) + 2 \
+        and not body[0:n - 1:_B64_LINE + 1].strip(b'\n') and body[-1:] == b'\n' \
+        and not (b'\r' in body or b' ' in body or b'\t' in body or b':' in body)
+
+def format_block(data: bytes, block: PemBlock) -> bytes:
+    """
+    Re-emit a block as canonical PEM: own BEGIN / END lines and
+    the body wrapped at 64 characters.
+    """
+    label = block.label.encode(ENC)
+    if block.der:
+        b64 = base64.b64encode(data[block.body_start:block.body_end])
+        lines = [b64[i:i + _B64_LINE] for i in range(0, len(b64), _B64_LINE)]
+    else:
+        body = data[block.body_start:block.body_end]
+        if _is_wrapped(body):
+            return data[block.start:block.end] + b'\n'
+        if b':' in body:
+            lines = [l.strip() for l in body.splitlines() if l.strip()]
+            # keep the blank line between RFC 1421 headers and the base64 data
+            n = max(i for i, l in enumerate(lines) if b':' in l) + 1
+            lines[n:n] = [b'']
+        else:
+            b64 = b''.join(body.split())
+            lines = [b64[i:i + _B64_LINE] for i in range(0, len(b64), _B64_LINE)]
+    return b'\n'.join([_BEGIN + label + _DASHES, *lines, _END + label + _DASHES, b''])
+
+def process_pem(pem: PemType, filename: str, kinds: tuple = None) -> bytes:
+    with STAGE_PEM.time():
+        return _process_pem(pem, filename, kinds)
+
+def _process_pem(pem: PemType, filename: str, kinds: tuple = None) -> bytes:
+    data = pem_to_bytes(pem, filename)
+    try:
+        blocks = parse_pem(data)
+    except Exception as err:
+        raise Exception(f'Wrong PEM format in file "{filename}": {str(err)}')
+    if kinds:
+        blocks = [b for b in blocks if b.kind in kinds]
+    if not blocks:
         raise Exception(f'Wrong PEM format in file "{filename}"')
-    if len(lines_pem) > 3:
-        lines_pem = [lines_pem[0], ''.join(lines_pem[1:-1]), lines_pem[-1]]
-    fpath = TEMP / filename
-    if fpath.exists():
-        os.remove(fpath)
-    with open(fpath, 'w', encoding=ENC) as f:
-        f.write(NL.join(lines_pem))
-    return fpath
-    
-def make_pkcs12(cert: PemType, certchain: PemType, key: PemType, name: str = None, password: str = None) -> bytes:
-    if not check_ossl():
-        raise Exception('OpenSSL path not found or invalid')
-    
-    uid = generate_uid()
+    return b''.join(format_block(data, b) for b in blocks)
+
+# ================ DISKLESS INPUTS
+
+SPOOL_PREFIX = 'spool-'
+
+def get_spool_root() -> Path:
+    if CONFIG.spool_dir:
+        return Path(CONFIG.spool_dir)
+    # prefer tmpfs so that spooled keys never reach a physical disk
+    shm = Path('/dev/shm')
+    return shm if shm.is_dir() else TEMP
+
+def get_spool_dir() -> Path:
+    spool = get_spool_root() / f'{SPOOL_PREFIX}{os.getpid()}'
+    if not spool.is_dir():
+        spool.mkdir(mode=0o700, parents=True, exist_ok=True)
+        atexit.register(shutil.rmtree, spool, True)
+    return spool
+
+def pid_alive(pid: int) -> bool:
+    if OSPLATFORM == 'Windows':
+        res = run_exe(['tasklist', '/FI', f'PID eq {pid}', '/NH'])
+        return str(pid) in (res.stdout or '')
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def cleanup_spool():
+    """
+    Remove spool directories left by crashed processes and stray
+    key / cert / p12 files written to TEMP by older versions.
+    """
+    root = get_spool_root()
+    for d in root.glob(f'{SPOOL_PREFIX}*'):
+        try:
+            pid = int(d.name[len(SPOOL_PREFIX):])
+        except ValueError:
+            continue
+        if pid != os.getpid() and not pid_alive(pid):
+            shutil.rmtree(d, ignore_errors=True)
+    if TEMP.is_dir():
+        for f in TEMP.iterdir():
+            if f.suffix in ('.key', '.crt', '.pem', '.p12') and re.fullmatch(r'[0-9a-f]{32}', f.stem):
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+
+def spool_size() -> int:
+    return sum(metrics.dir_size(d) for d in get_spool_root().glob(f'{SPOOL_PREFIX}*'))
+
+# walked only when the metrics are scraped
+metrics.Gauge('temp_dir_bytes', 'Size of the files in TEMP_DIR', func=lambda: metrics.dir_size(TEMP))
+metrics.Gauge('spool_bytes', 'Size of the spooled input / output files of all bot processes', func=spool_size)
+
+class InputFiles:
+    """
+    Hands PEM data to a child openssl process without touching the disk:
+    anonymous memory files (memfd) passed as /dev/fd/N on Linux,
+    otherwise short-lived files in a private spool dir on tmpfs
+    which are removed on exit.
+    """
+
+    def __init__(self, memfd: bool = True):
+        self.fds = []
+        self.files = []
+        self.use_memfd = memfd and hasattr(os, 'memfd_create') and Path('/dev/fd').is_dir()
+
+    def reserve(self, name: str) -> Path:
+        # a spool path for openssl to write to, removed on exit like the inputs
+        fpath = get_spool_dir() / f'{generate_uid()}-{name}'
+        self.files.append(fpath)
+        return fpath
+
+    def add(self, data: bytes, name: str) -> str:
+        if self.use_memfd:
+            fd = os.memfd_create(name, 0)
+            self.fds.append(fd)
+            os.write(fd, data)
+            os.lseek(fd, 0, os.SEEK_SET)
+            return f'/dev/fd/{fd}'
+        fpath = self.reserve(name)
+        fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return str(fpath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for fd in self.fds:
+            os.close(fd)
+        for fpath in self.files:
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+        self.fds, self.files = [], []
+
+# ================ PKCS12 PROFILES
+
+class Pkcs12Profile(NamedTuple):
+    """
+    Encryption / KDF choices of a PKCS12 export. None = the backend default
+    (for the CLI: 3DES / RC2-40 + SHA1 MAC before OpenSSL 3.0, AES-256 + SHA256 since).
+    """
+    name: str
+    # openssl pkcs12 -keypbe / -certpbe / -macalg / -iter
+    keypbe: Optional[str] = None
+    certpbe: Optional[str] = None
+    macalg: Optional[str] = None
+    iter: Optional[int] = None
+    # the same for the cryptography backend: a PBES member and a hash name
+    # (it always encrypts the certificates with the key algorithm)
+    pbes: Optional[str] = None
+    mac: Optional[str] = None
+    description: str = ''
+
+PKCS12_DEFAULT_ITER = 2048
+
+PROFILES = {p.name: p for p in (
+    Pkcs12Profile('default', description='backend defaults'),
+    # older Java (before 8u301) and Windows (before 10 1709 / Server 2019) cannot read PBES2 / AES bundles;
+    # 3DES instead of RC2-40 for the certs: the same reach without the OpenSSL 3 legacy provider
+    Pkcs12Profile('legacy-compatible', 'PBE-SHA1-3DES', 'PBE-SHA1-3DES', 'sha1', PKCS12_DEFAULT_ITER,
+                  'PBESv1SHA1And3KeyTripleDESCBC', 'SHA1', '3DES + SHA1 MAC, imports on old Java / Windows'),
+    Pkcs12Profile('modern', 'AES-256-CBC', 'AES-256-CBC', 'sha256', 100000,
+                  'PBESv2SHA256AndAES256CBC', 'SHA256', 'AES-256 + PBKDF2-SHA256, 100000 iterations'),
+    # certificates are public: only the key is encrypted (the CLI, the cryptography backend cannot skip it)
+    Pkcs12Profile('fast', 'AES-256-CBC', 'NONE', 'sha256', PKCS12_DEFAULT_ITER,
+                  'PBESv2SHA256AndAES256CBC', 'SHA256', 'AES-256 for the key only, 2048 iterations'),
+)}
+
+def get_profile(name: str = None) -> Pkcs12Profile:
+    name = name or CONFIG.pkcs12_profile
+    if name not in PROFILES:
+        raise Exception(f'Unknown PKCS12 profile "{name}", use one of: {", ".join(PROFILES)}')
+    return PROFILES[name]
+
+def profile_args(profile: Pkcs12Profile, caps: OsslCaps) -> list[str]:
+    args = []
+    for option, value in (('-keypbe', profile.keypbe), ('-certpbe', profile.certpbe),
+                          ('-macalg', profile.macalg), ('-iter', profile.iter)):
+        if value is None:
+            continue
+        if not caps.supports(option):
+            # OpenSSL 1.x has no -iter but uses the same default count
+            if option == '-iter' and value == PKCS12_DEFAULT_ITER:
+                continue
+            raise Exception(f'{caps.version} does not support {option} needed by the PKCS12 profile "{profile.name}"')
+        args += [option, str(value)]
+    return args
 
-    outfile = TEMP / f'{uid}.p12'
-    if outfile.exists():
-        os.remove(outfile)
+def profile_encryption(profile: Pkcs12Profile, password: str):
+    if profile.pbes is None:
+        return serialization.BestAvailableEncryption(password.encode(ENC)) if password else serialization.NoEncryption()
+    if not password:
+        # the encryption builder needs a password: get_backend('auto') takes the CLI for these
+        raise Exception(f'cryptography cannot encrypt with an empty password, '
+                        f'the PKCS12 profile "{profile.name}" needs the cli backend')
+    if not hasattr(serialization.PrivateFormat.PKCS12, 'encryption_builder'):
+        raise Exception(f'The PKCS12 profile "{profile.name}" needs cryptography >= 38')
+    return serialization.PrivateFormat.PKCS12.encryption_builder() \
+        .kdf_rounds(profile.iter or PKCS12_DEFAULT_ITER) \
+        .key_cert_algorithm(getattr(pkcs12.PBES, profile.pbes)) \
+        .hmac_hash(getattr(hashes, profile.mac)()) \
+        .build(password.encode(ENC))
 
-    args = [SSLEXE, 'pkcs12', '-export', '-passout', f'pass:{password or ""}', '-out', str(outfile)]
+def _pem_reader(normalized: bool):
+    # inputs already checked and normalized at upload (see validate.py) skip the PEM parser
+    if normalized:
+        return lambda pem, filename, kinds=None: pem_to_bytes(pem, filename)
+    return process_pem
+
+def make_pkcs12_cli(cert: PemType, certchain: PemType, key: PemType, name: str = None, password: str = None,
+                    normalized: bool = False, profile: Pkcs12Profile = None) -> bytes:
+    caps = get_caps()
+    read_pem = _pem_reader(normalized)
+    pooled = get_pool() is not None
+
+    args = [caps.exe, 'pkcs12', '-export', *profile_args(profile or get_profile(), caps)]
     if name: args += ['-name', name]
 
-    if not key is None:
-        key_file = process_pem(key, f'{uid}.key')
-        args += ['-inkey', str(key_file)]
-    else:
-        args += ['-nokeys']
-
-    if not cert is None:
-        cert_file = process_pem(cert, f'{uid}.crt')
-        # openssl pkcs12 -export -in cert.crt -inkey cert.key -passout pass:123123 -out cert1.p12
-        args += ['-in', str(cert_file)]
-    elif not certchain is None:
-        certchain_file = process_pem(certchain, f'{uid}.pem')
-        # openssl pkcs12 -export -in certchain.pem -inkey cert.key -passout pass:123123 -out cert1.p12
-        args += ['-in', str(certchain_file)]
-    else:
-        raise Exception('At least a CERT or a CERT CHAIN file must exist!')
-    
+    # a warm session cannot receive our memfd's, so the pooled mode goes through the tmpfs spool
+    with InputFiles(memfd=not pooled) as inputs:
+        if pooled:
+            outfile = inputs.reserve('p12')
+            args += ['-passout', f'file:{inputs.add((password or "").encode(ENC) + NL.encode(), "pw")}',
+                     '-out', str(outfile)]
+        else:
+            # no "-out": the bundle is read back from stdout
+            args += ['-passout', f'pass:{password or ""}']
+
+        if not key is None:
+            args += ['-inkey', inputs.add(read_pem(key, 'key', (KIND_KEY,)), 'key')]
+        else:
+            args += ['-nokeys']
+
+        if not cert is None:
+            # openssl pkcs12 -export -in cert.crt -inkey cert.key -passout pass:123123 -out cert1.p12
+            args += ['-in', inputs.add(read_pem(cert, 'crt', (KIND_CERT,)), 'crt')]
+            if not certchain is None:
+                args += ['-certfile', inputs.add(read_pem(certchain, 'pem', (KIND_CERT,)), 'pem')]
+        elif not certchain is None:
+            # openssl pkcs12 -export -in certchain.pem -inkey cert.key -passout pass:123123 -out cert1.p12
+            args += ['-in', inputs.add(read_pem(certchain, 'pem', (KIND_CERT,)), 'pem')]
+        else:
+            raise Exception('At least a CERT or a CERT CHAIN file must exist!')
+
+        try:
+            with STAGE_PKCS12.time():
+                if pooled:
+                    res = run_exe(args, encoding=None, timeout=CONFIG.ossl_timeout, pooled=True)
+                else:
+                    res = run_exe(args, encoding=None, timeout=CONFIG.ossl_timeout, pass_fds=inputs.fds)
+            if res.returncode:
+                raise Exception((res.stderr or res.stdout).decode(ENC, 'replace'))
+        except:
+            logging.exception(traceback.format_exc())
+            raise
+
+        if pooled:
+            with STAGE_READ.time(), open(outfile, 'rb') as f:
+                data = f.read()
+        else:
+            data = res.stdout
+
+    if not data:
+        raise Exception('Error exporting PKCS key: empty output')
+
+    return data
+
+def make_pkcs12_crypto(cert: PemType, certchain: PemType, key: PemType, name: str = None, password: str = None,
+                       normalized: bool = False, profile: Pkcs12Profile = None) -> bytes:
+    if pkcs12 is None:
+        raise Exception('Python package "cryptography" is not installed')
+    read_pem = _pem_reader(normalized)
+
     try:
-        res = run_exe(args)
-        if res.returncode:
-            raise Exception(res.stderr if res.stderr else res.stdout)
-        res.check_returncode()
+        if not cert is None:
+            certs = x509.load_pem_x509_certificates(read_pem(cert, 'crt', (KIND_CERT,)))
+            if not certchain is None:
+                certs += x509.load_pem_x509_certificates(read_pem(certchain, 'pem', (KIND_CERT,)))
+        elif not certchain is None:
+            certs = x509.load_pem_x509_certificates(read_pem(certchain, 'pem', (KIND_CERT,)))
+        else:
+            raise Exception('At least a CERT or a CERT CHAIN file must exist!')
+        # like "openssl pkcs12 -export", which does not run the RSA consistency check either;
+        # the key <-> certificate match below is what a bundle needs
+        privkey = None if key is None else \
+            serialization.load_pem_private_key(read_pem(key, 'key', (KIND_KEY,)), None, **SKIP_RSA_CHECK)
+    except ValueError as err:
+        raise Exception(f'Wrong PEM format: {str(err)}')
+
+    main_cert = None
+    if privkey:
+        # like "openssl pkcs12 -export": the cert matching the key is the main one
+        pubkey = privkey.public_key().public_bytes(serialization.Encoding.DER,
+                                                   serialization.PublicFormat.SubjectPublicKeyInfo)
+        for crt in certs:
+            if crt.public_key().public_bytes(serialization.Encoding.DER,
+                                             serialization.PublicFormat.SubjectPublicKeyInfo) == pubkey:
+                main_cert = crt
+                break
+        if main_cert is None:
+            raise Exception('No certificate matches the private key')
+        certs = [crt for crt in certs if crt is not main_cert]
+
+    encryption = profile_encryption(profile or get_profile(), password)
+    with STAGE_PKCS12.time():
+        return pkcs12.serialize_key_and_certificates(name.encode(ENC) if name else None,
+                                                     privkey, main_cert, certs or None, encryption)
+
+# ================ PKCS12 BACKENDS
+
+class Pkcs12Backend:
+    name = ''
+
+    def available(self) -> bool:
+        return True
+
+    def supports(self, password: str, profile: Pkcs12Profile) -> bool:
+        return True
+
+    def check_profile(self, profile: Pkcs12Profile):
+        """
+        Raise if the installed OpenSSL / cryptography cannot export with this profile.
+        """
+
+    def make_pkcs12(self, cert: PemType, certchain: PemType, key: PemType, name: str = None, password: str = None,
+                    normalized: bool = False, profile: Pkcs12Profile = None) -> bytes:
+        raise NotImplementedError
+
+class CliBackend(Pkcs12Backend):
+    name = 'cli'
+
+    def available(self) -> bool:
+        return check_ossl() is not None
+
+    def check_profile(self, profile: Pkcs12Profile):
+        profile_args(profile, get_caps())
+
+    def make_pkcs12(self, cert: PemType, certchain: PemType, key: PemType, name: str = None, password: str = None,
+                    normalized: bool = False, profile: Pkcs12Profile = None) -> bytes:
+        return make_pkcs12_cli(cert, certchain, key, name, password, normalized, profile)
+
+class CryptoBackend(Pkcs12Backend):
+    name = 'crypto'
+
+    def available(self) -> bool:
+        return pkcs12 is not None
+
+    def supports(self, password: str, profile: Pkcs12Profile) -> bool:
+        # no profile encryption without a password (see profile_encryption)
+        return bool(password) or profile.pbes is None
+
+    def check_profile(self, profile: Pkcs12Profile):
+        if profile.pbes is not None and not hasattr(serialization.PrivateFormat.PKCS12, 'encryption_builder'):
+            raise Exception(f'The PKCS12 profile "{profile.name}" needs cryptography >= 38')
+
+    def make_pkcs12(self, cert: PemType, certchain: PemType, key: PemType, name: str = None, password: str = None,
+                    normalized: bool = False, profile: Pkcs12Profile = None) -> bytes:
+        return make_pkcs12_crypto(cert, certchain, key, name, password, normalized, profile)
+
+BACKENDS = {b.name: b for b in (CliBackend(), CryptoBackend())}
+
+def get_backend(name: str = None, password: str = None, profile: Pkcs12Profile = None) -> Pkcs12Backend:
+    name = name or CONFIG.pkcs12_backend
+    if name == 'auto':
+        crypto = BACKENDS['crypto']
+        usable = crypto.available() and (profile is None or crypto.supports(password, profile))
+        return crypto if usable else BACKENDS['cli']
+    if name not in BACKENDS:
+        raise Exception(f'Unknown PKCS12 backend "{name}", use one of: auto, {", ".join(BACKENDS)}')
+    return BACKENDS[name]
+
+def check_profile(name: str = None, password: str = None, backend: str = None) -> Pkcs12Profile:
+    """
+    The profile if the backend exporting with it can run it here, else raise
+    (e.g. "modern" needs -iter, which the OpenSSL 1.x CLI does not have).
+    """
+    profile = get_profile(name)
+    get_backend(backend, password, profile).check_profile(profile)
+    return profile
+
+def usable_profiles(password: str = None, backend: str = None) -> list[str]:
+    """
+    Names of the profiles check_profile accepts for this password.
+    """
+    usable = []
+    for name in PROFILES:
+        try:
+            check_profile(name, password, backend)
+        except Exception:
+            continue
+        usable.append(name)
+    return usable
+
+def make_pkcs12(cert: PemType, certchain: PemType, key: PemType, name: str = None, password: str = None,
+                backend: str = None, normalized: bool = False, profile: str = None) -> bytes:
+    settings = get_profile(profile)
+    impl = get_backend(backend, password, settings)
+    start = time.perf_counter()
+    try:
+        data = impl.make_pkcs12(cert, certchain, key, name, password, normalized, settings)
     except:
-        logging.exception(traceback.format_exc())
+        metrics.CONVERSIONS.labels(impl.name, 'error').inc()
         raise
+    STAGE_CONVERT.observe(time.perf_counter() - start)
+    metrics.CONVERSIONS.labels(impl.name, 'ok').inc()
+    return data
 
-    if not outfile.exists():
-        raise Exception(f'Error exporting PKCS key to "{str(outfile)}"')
-    
-    res = None
-    with open(outfile, 'rb') as f:
-        res = f.read()
+def cert_fingerprint(der: bytes) -> str:
+    return hashlib.sha256(der).hexdigest()
+
+def verify_pkcs12(data: bytes, password: str = None) -> tuple:
+    """
+    Open a PKCS12 bundle and return (has_key, sorted cert SHA256 fingerprints, friendly_name)
+    so that bundles produced by different backends can be compared.
+    """
+    if pkcs12 is not None:
+        try:
+            p12 = pkcs12.load_pkcs12(data, password.encode(ENC) if password else None)
+        except ValueError as err:
+            raise Exception(f'Invalid PKCS12 bundle: {str(err)}')
+        certs = ([p12.cert] if p12.cert else []) + list(p12.additional_certs)
+        name = p12.cert.friendly_name.decode(ENC) if p12.cert and p12.cert.friendly_name else None
+        fps = [cert_fingerprint(c.certificate.public_bytes(serialization.Encoding.DER)) for c in certs]
+        return (p12.key is not None, sorted(fps), name)
+
+    caps = get_caps()
+    res = run_exe([caps.exe, 'pkcs12', '-nodes', '-passin', f'pass:{password or ""}'],
+                  input=data, encoding=None)
+    if res.returncode:
+        raise Exception(f'Invalid PKCS12 bundle: {res.stderr.decode(ENC, "replace")}')
+    out = res.stdout.decode(ENC, 'replace')
+    certs = re.findall(r'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', out, re.S)
+    names = re.findall(r'friendlyName:\s*(.+)$', out, re.M)
+    fps = [cert_fingerprint(base64.b64decode(''.join(c.split()))) for c in certs]
+    return ('PRIVATE KEY-----' in out, sorted(fps), names[0].strip() if names else None)
+
+# ================ CERT / KEY INSPECTION
+
+class CertInfo(NamedTuple):
+    subject: str
+    issuer: str
+    not_before: datetime
+    not_after: datetime
+    # SHA256 of the certificate DER
+    fingerprint: str
+    # SHA256 of the SubjectPublicKeyInfo DER, equal for a cert and its private key
+    key_fingerprint: str
+    is_ca: bool
+    pem: bytes
+    # subject / authority key identifiers (hex), '' if absent
+    ski: str = ''
+    aki: str = ''
+
+    @property
+    def self_signed(self) -> bool:
+        return self.subject == self.issuer
+
+    @property
+    def common_name(self) -> str:
+        m = re.search(r'(?:^|,)CN=((?:[^,\\]|\\.)+)', self.subject)
+        return m.group(1).replace('\\', '') if m else self.subject
+
+RE_X509_FIELD = re.compile(r'^(subject|issuer|notBefore|notAfter)=\s*(.*)$', re.M)
+RE_SKI = re.compile(r'Subject Key Identifier:\s*\n\s*([0-9A-Fa-f:]+)')
+RE_AKI = re.compile(r'Authority Key Identifier:\s*\n\s*(?:keyid:)?([0-9A-Fa-f:]+)')
+
+def _key_id(m: Optional[re.Match]) -> str:
+    return m.group(1).replace(':', '').lower() if m else ''
+
+def _ossl_date(value: str) -> datetime:
+    return datetime.strptime(' '.join(value.split()), '%b %d %H:%M:%S %Y %Z').replace(tzinfo=timezone.utc)
+
+def _pem_to_der(pem: bytes) -> bytes:
+    blocks = parse_pem(pem)
+    if not blocks:
+        raise Exception('No PEM block found')
+    return block_der(pem, blocks[0])
+
+def inspect_cert(pem: bytes) -> CertInfo:
+    """
+    Parse a single PEM certificate (the first block of `pem`).
+    """
+    if x509 is not None:
+        try:
+            crt = x509.load_pem_x509_certificate(pem)
+        except ValueError as err:
+            raise Exception(f'Invalid certificate: {str(err)}')
+        try:
+            is_ca = crt.extensions.get_extension_for_class(x509.BasicConstraints).value.ca
+        except x509.ExtensionNotFound:
+            is_ca = False
+        try:
+            ski = crt.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).value.digest.hex()
+        except x509.ExtensionNotFound:
+            ski = ''
+        try:
+            aki = (crt.extensions.get_extension_for_class(x509.AuthorityKeyIdentifier).value.key_identifier
+                   or b'').hex()
+        except x509.ExtensionNotFound:
+            aki = ''
+        spki = crt.public_key().public_bytes(serialization.Encoding.DER,
+                                             serialization.PublicFormat.SubjectPublicKeyInfo)
+        not_before = getattr(crt, 'not_valid_before_utc', None) or crt.not_valid_before.replace(tzinfo=timezone.utc)
+        not_after = getattr(crt, 'not_valid_after_utc', None) or crt.not_valid_after.replace(tzinfo=timezone.utc)
+        return CertInfo(crt.subject.rfc4514_string(), crt.issuer.rfc4514_string(), not_before, not_after,
+                        cert_fingerprint(crt.public_bytes(serialization.Encoding.DER)),
+                        hashlib.sha256(spki).hexdigest(), is_ca, pem, ski, aki)
+
+    caps = get_caps()
+    res = run_exe([caps.exe, 'x509', '-noout', '-subject', '-issuer', '-startdate', '-enddate',
+                   '-nameopt', 'RFC2253', '-pubkey', '-ext',
+                   'basicConstraints,subjectKeyIdentifier,authorityKeyIdentifier'], input=pem.decode(ENC))
+    if res.returncode:
+        raise Exception(f'Invalid certificate: {res.stderr}')
+    fields = dict(RE_X509_FIELD.findall(res.stdout))
+    spki = _pem_to_der(res.stdout.encode(ENC)[res.stdout.index(PEM_START):])
+    return CertInfo(fields['subject'], fields['issuer'], _ossl_date(fields['notBefore']),
+                    _ossl_date(fields['notAfter']), cert_fingerprint(_pem_to_der(pem)),
+                    hashlib.sha256(spki).hexdigest(), 'CA:TRUE' in res.stdout, pem,
+                    _key_id(RE_SKI.search(res.stdout)), _key_id(RE_AKI.search(res.stdout)))
+
+def key_fingerprint(pem: bytes) -> str:
+    """
+    SHA256 of the public key (SubjectPublicKeyInfo DER) of a PEM private key.
+    """
+    if serialization is not None:
+        try:
+            key = serialization.load_pem_private_key(pem, None, **SKIP_RSA_CHECK)
+        except (ValueError, TypeError) as err:
+            raise Exception(f'Invalid or encrypted private key: {str(err)}')
+        return hashlib.sha256(key.public_key().public_bytes(serialization.Encoding.DER,
+                              serialization.PublicFormat.SubjectPublicKeyInfo)).hexdigest()
+
+    caps = get_caps()
+    res = run_exe([caps.exe, 'pkey', '-pubout', '-outform', 'DER', '-passin', 'pass:'],
+                  input=pem, encoding=None)
+    if res.returncode:
+        raise Exception(f'Invalid or encrypted private key: {res.stderr.decode(ENC, "replace")}')
+    return hashlib.sha256(res.stdout).hexdigest()
+
+def verify_issued(cert: bytes, issuer: bytes) -> bool:
+    """
+    True if the PEM certificate `cert` names `issuer` as its issuer and is
+    signed by its key. Validity dates are not checked here.
+    """
+    if x509 is not None and hasattr(x509.Certificate, 'verify_directly_issued_by'):
+        try:
+            x509.load_pem_x509_certificate(cert).verify_directly_issued_by(x509.load_pem_x509_certificate(issuer))
+            return True
+        except (ValueError, TypeError, InvalidSignature):
+            return False
 
-    return res
\ No newline at end of file
+    caps = get_caps()
+    with InputFiles() as inputs:
+        res = run_exe([caps.exe, 'verify', '-no_check_time', '-partial_chain',
+                       '-CAfile', inputs.add(issuer, 'ca'), inputs.add(cert, 'crt')], pass_fds=inputs.fds)
+    return res.returncode == 0
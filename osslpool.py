@@ -0,0 +1,204 @@
+import subprocess as sp
+import os, time, queue, threading, logging, selectors
+from contextlib import contextmanager
+from typing import Optional
+
+# ============================================================ #
+
+PROMPT = b'OpenSSL> '
+ERROR_MARK = b'error in '
+QUIT = b'quit\n'
+
+# ============================================================ #
+
+class SessionError(Exception):
+    pass
+
+class SessionTimeout(SessionError):
+    pass
+
+def quote_arg(arg) -> str:
+    # the interactive prompt splits on whitespace and understands '...' and "..." (no escapes)
+    arg = str(arg)
+    if arg and not any(c.isspace() or c in '\'"' for c in arg):
+        return arg
+    if '"' not in arg:
+        return f'"{arg}"'
+    if "'" not in arg:
+        return f"'{arg}'"
+    raise SessionError(f'Cannot pass argument with both quote types to OpenSSL session: {arg}')
+
+class OsslSession:
+    """
+    One long-lived `openssl` process running its interactive command prompt
+    (OpenSSL 1.x only). Commands are written to stdin one per line; the end of
+    a command's output is the next "OpenSSL> " prompt, failures are reported
+    by openssl as a trailing "error in <command>" line.
+    """
+
+    def __init__(self, exe: str, timeout: float = 30):
+        self.exe = exe
+        self.timeout = timeout
+        self.proc: Optional[sp.Popen] = None
+        self.commands = 0
+        self.last_used = 0.0
+        self.start()
+
+    def start(self):
+        self.close()
+        self.proc = sp.Popen([self.exe], stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.STDOUT, bufsize=0)
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        self.commands = 0
+        self._read_until_prompt(self.timeout)
+        self.last_used = time.monotonic()
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def execute(self, args: list, timeout: float = None) -> tuple[bool, bytes]:
+        if not self.alive():
+            raise SessionError('OpenSSL session is not running')
+        line = ' '.join(quote_arg(a) for a in args)
+        if '\n' in line or '\r' in line:
+            raise SessionError('Line breaks are not allowed in OpenSSL session commands')
+        try:
+            self.proc.stdin.write(line.encode() + b'\n')
+            self.proc.stdin.flush()
+        except OSError as err:
+            raise SessionError(f'OpenSSL session crashed: {str(err)}')
+        out = self._read_until_prompt(timeout or self.timeout)
+        self.commands += 1
+        self.last_used = time.monotonic()
+        lines = out.rstrip().splitlines()
+        ok = not (lines and lines[-1].startswith(ERROR_MARK))
+        return ok, out
+
+    def check(self, timeout: float = 5) -> bool:
+        try:
+            ok, out = self.execute(['version'], timeout)
+            return ok and out.startswith(b'OpenSSL')
+        except SessionError:
+            return False
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            if self.proc.poll() is None:
+                self.proc.stdin.write(QUIT)
+                self.proc.stdin.flush()
+                self.proc.wait(1)
+        except (OSError, sp.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        finally:
+            self.proc.stdin.close()
+            self.proc.stdout.close()
+            self.proc = None
+
+    def _read_until_prompt(self, timeout: float) -> bytes:
+        buf = bytearray()
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as sel:
+            sel.register(self.proc.stdout, selectors.EVENT_READ)
+            while not buf.endswith(PROMPT):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    # output of a hung command cannot be told apart from the next one: kill it
+                    self.proc.kill()
+                    raise SessionTimeout(f'OpenSSL session timed out after {timeout} s')
+                if not sel.select(left):
+                    continue
+                chunk = self.proc.stdout.read(65536)
+                if chunk == b'':
+                    raise SessionError('OpenSSL session terminated unexpectedly')
+                if chunk:
+                    buf += chunk
+        return bytes(buf[:-len(PROMPT)])
+
+class OsslPool:
+    """
+    Pool of `size` warm OpenSSL sessions. Sessions are started lazily,
+    health-checked when idle for longer than `health_interval`,
+    restarted after a crash / timeout and recycled after `max_commands`.
+    """
+
+    def __init__(self, exe: str, size: int = 2, timeout: float = 30, health_interval: float = 60,
+                 max_commands: int = 1000):
+        self.exe = exe
+        self.size = size
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.max_commands = max_commands
+        self._idle: queue.LifoQueue[OsslSession] = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, timeout: float = None) -> OsslSession:
+        if self._closed:
+            raise SessionError('OpenSSL pool is closed')
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return OsslSession(self.exe, self.timeout)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                session = self._idle.get(timeout=timeout or self.timeout)
+            except queue.Empty:
+                raise SessionError('No free OpenSSL session')
+        if not session.alive() or \
+            (time.monotonic() - session.last_used > self.health_interval and not session.check()):
+            logging.warning('OpenSSL session is unhealthy, restarting')
+            try:
+                session.start()
+            except Exception:
+                session.close()
+                with self._lock:
+                    self._created -= 1
+                raise
+        return session
+
+    def release(self, session: OsslSession):
+        if self._closed:
+            session.close()
+            return
+        if not session.alive() or session.commands >= self.max_commands:
+            try:
+                session.start()
+            except Exception as err:
+                logging.exception(err)
+                session.close()
+                with self._lock:
+                    self._created -= 1
+                return
+        self._idle.put(session)
+
+    @contextmanager
+    def session(self):
+        session = self.acquire()
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def execute(self, args: list, timeout: float = None) -> tuple[bool, bytes]:
+        with self.session() as session:
+            return session.execute(args, timeout)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
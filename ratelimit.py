@@ -0,0 +1,236 @@
+"""
+Outbound Bot API scheduler: every request addressed to a chat passes a global
+and a per-chat token bucket sized to Telegram's flood limits, so bursts are
+smoothed here instead of coming back as 429 errors. Waiting requests are
+served by priority (documents, then messages, then chat actions); chat
+actions never take the last token of a chat, are dropped once stale and are
+never retried. A 429 answer pauses the chat for retry_after and the request
+is sent again.
+"""
+import asyncio, itertools, logging, time
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod, SendChatAction
+
+from config import CONFIG
+import metrics
+
+# ============================================================ #
+
+PRIO_UPLOAD, PRIO_MESSAGE, PRIO_ACTION = 0, 1, 2
+PRIORITIES = {'SendDocument': PRIO_UPLOAD, 'SendPhoto': PRIO_UPLOAD, 'SendMediaGroup': PRIO_UPLOAD,
+              'SendChatAction': PRIO_ACTION}
+# tokens a chat must keep for real messages before a chat action may be sent
+ACTION_RESERVE = 1
+# idle chat buckets are forgotten when there are more than this many
+MAX_CHATS = 10000
+
+SEND_WAIT = metrics.stage('send_wait')
+FLOOD_WAITS = metrics.Counter('flood_waits_total', '429 answers (retry_after) from the Bot API')
+ACTIONS_DROPPED = metrics.Counter('chat_actions_dropped_total', 'Chat actions dropped by the rate limiter')
+
+# ============================================================ #
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp', 'last_message')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        # when the last non-action request was sent (a chat action queued before it is moot)
+        self.last_message = 0.0
+
+    def _refill(self, now: float):
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def delay(self, now: float, need: float = 1) -> float:
+        """
+        Seconds until `need` tokens are available (0 = now).
+        """
+        if now < self.stamp:
+            # paused by a flood wait
+            return self.stamp - now + (need - self.tokens) / self.rate
+        self._refill(now)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        # no tokens until the flood wait is over
+        self.tokens = 0
+        self.stamp = max(self.stamp, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        return self.delay(now, self.capacity) == 0
+
+class _Waiter:
+    __slots__ = ('key', 'chat', 'future', 'queued', 'action')
+
+    def __init__(self, key: tuple, chat: TokenBucket, future: asyncio.Future, queued: float, action: bool):
+        self.key = key
+        self.chat = chat
+        self.future = future
+        self.queued = queued
+        self.action = action
+
+class RateLimiter(BaseRequestMiddleware):
+    """
+    Session request middleware: bot.session.middleware(RateLimiter()).
+    Requests without a chat_id (getMe, getUpdates, getFile...) pass through.
+    """
+
+    def __init__(self, rate: float = None, chat_rate: float = None, group_rate: float = None,
+                 burst: float = None, action_stale: float = None, retries: int = None):
+        self.rate = rate or CONFIG.rate_global
+        self.chat_rate = chat_rate or CONFIG.rate_chat
+        self.group_rate = group_rate or CONFIG.rate_group
+        self.burst = burst or CONFIG.rate_burst
+        self.action_stale = CONFIG.rate_action_stale if action_stale is None else action_stale
+        self.retries = CONFIG.rate_retries if retries is None else retries
+        self.bucket = TokenBucket(self.rate, max(1, self.rate))
+        self.chats: dict[Any, TokenBucket] = {}
+        self._waiting: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+
+    def share(self, parts: int):
+        # one of `parts` processes sending for the same bot token
+        self.rate /= parts
+        self.bucket = TokenBucket(self.rate, max(1, self.rate))
+
+    @property
+    def pending(self) -> int:
+        return len(self._waiting)
+
+    def chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= MAX_CHATS:
+                now = time.monotonic()
+                for key in [k for k, b in self.chats.items() if b.idle(now)]:
+                    del self.chats[key]
+            # private chats have positive ids, groups and channels negative ids or @names
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate if private else self.group_rate, self.burst)
+        return bucket
+
+    # ================ SCHEDULING
+
+    def _ready(self, chat: TokenBucket, now: float, action: bool) -> float:
+        return max(self.bucket.delay(now), chat.delay(now, 1 + ACTION_RESERVE if action else 1))
+
+    async def acquire(self, chat: TokenBucket, priority: int) -> bool:
+        """
+        Wait for a global and a chat token. False = a chat action was dropped.
+        """
+        now = time.monotonic()
+        action = priority == PRIO_ACTION
+        if not self._waiting and not self._ready(chat, now, action):
+            self._grant(chat, now, action)
+            return True
+        if action and chat.delay(now, 1 + ACTION_RESERVE) > self.action_stale:
+            # would be stale before the chat has a spare token: don't make ChatActionSender wait for it
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append(_Waiter((priority, next(self._seq)), chat, future, now, action))
+        self._waiting.sort(key=lambda w: w.key)
+        self._wake.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        granted = await future
+        SEND_WAIT.observe(time.monotonic() - now)
+        return granted
+
+    def _grant(self, chat: TokenBucket, now: float, action: bool):
+        self.bucket.take(now)
+        chat.take(now)
+        if not action:
+            chat.last_message = now
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """
+        Grant the first waiter (by priority) that can go now and drop stale
+        chat actions. Returns None if the queue changed, else how long to sleep.
+        """
+        empty = self.bucket.delay(now)
+        sleep = empty or float('inf')
+        for waiter in list(self._waiting):
+            if waiter.future.done():
+                # the caller was cancelled
+                self._waiting.remove(waiter)
+                continue
+            if waiter.action:
+                age = now - waiter.queued
+                if age > self.action_stale or waiter.chat.last_message > waiter.queued:
+                    self._waiting.remove(waiter)
+                    waiter.future.set_result(False)
+                    return None
+                sleep = min(sleep, self.action_stale - age)
+            if empty:
+                # nobody can go before the global bucket refills
+                continue
+            delay = waiter.chat.delay(now, 1 + ACTION_RESERVE if waiter.action else 1)
+            if not delay:
+                self._waiting.remove(waiter)
+                self._grant(waiter.chat, now, waiter.action)
+                waiter.future.set_result(True)
+                return None
+            sleep = min(sleep, delay)
+        return sleep if self._waiting else None
+
+    async def _run(self):
+        while self._waiting:
+            self._wake.clear()
+            sleep = self._dispatch(time.monotonic())
+            if sleep is None:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), sleep)
+            except asyncio.TimeoutError:
+                pass
+
+    # ================ MIDDLEWARE
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        priority = PRIORITIES.get(type(method).__name__, PRIO_MESSAGE)
+        chat = self.chat_bucket(chat_id)
+        for attempt in range(self.retries + 1):
+            if not await self.acquire(chat, priority):
+                ACTIONS_DROPPED.inc()
+                return True
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as err:
+                FLOOD_WAITS.inc()
+                chat.pause(err.retry_after)
+                if isinstance(method, SendChatAction):
+                    ACTIONS_DROPPED.inc()
+                    return True
+                if attempt == self.retries:
+                    raise
+                logging.warning(f'Flood wait {err.retry_after} s in chat {chat_id}, '
+                                f'retry {attempt + 1} of {self.retries}')
+
+LIMITERS: list[RateLimiter] = []
+
+def install(bot: Bot) -> RateLimiter:
+    limiter = RateLimiter()
+    bot.session.middleware(limiter)
+    LIMITERS.append(limiter)
+    return limiter
+
+metrics.Gauge('send_queue', 'Bot API requests waiting for the rate limiter',
+              func=lambda: sum(limiter.pending for limiter in LIMITERS))
@@ -0,0 +1,221 @@
+import asyncio, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import CONFIG
+
+# ============================================================ #
+
+def encode_data(data: Dict[str, Any]) -> bytes:
+    # one compact UTF-8 blob per user instead of a dict of str objects
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8') if data else b''
+
+def decode_data(blob: bytes) -> Dict[str, Any]:
+    return json.loads(blob) if blob else {}
+
+def state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+# ================ MEMORY
+
+class TTLRecord:
+    __slots__ = ('state', 'blob', 'expires')
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        self.blob = b''
+        self.expires = 0.0
+
+class TTLMemoryStorage(BaseStorage):
+    """
+    In-memory FSM storage with a sliding per-entry TTL and a global byte budget:
+    the least recently used entries are evicted first. Data is kept as one
+    encoded blob per key.
+    """
+
+    def __init__(self, ttl: float = 3600, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._records: OrderedDict[StorageKey, TTLRecord] = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    @property
+    def count(self) -> int:
+        # no __len__: the Dispatcher would take an empty storage for "no storage"
+        return len(self._records)
+
+    async def close(self) -> None:
+        self._records.clear()
+        self._bytes = 0
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        record = self._touch(key, create=state is not None)
+        if record:
+            record.state = state_name(state)
+            self._drop_empty(key, record)
+
+    async def get_state(self, bot: Bot, key: StorageKey) -> Optional[str]:
+        record = self._touch(key)
+        return record.state if record else None
+
+    async def set_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> None:
+        blob = encode_data(data)
+        record = self._touch(key, create=bool(blob))
+        if record:
+            self._bytes += len(blob) - len(record.blob)
+            record.blob = blob
+            self._drop_empty(key, record)
+            self._evict()
+
+    async def get_data(self, bot: Bot, key: StorageKey) -> Dict[str, Any]:
+        record = self._touch(key)
+        return decode_data(record.blob) if record else {}
+
+    def _touch(self, key: StorageKey, create: bool = False) -> Optional[TTLRecord]:
+        now = time.monotonic()
+        self._expire(now)
+        record = self._records.get(key)
+        if record is not None and record.expires <= now:
+            self._remove(key)
+            record = None
+        if record is None:
+            if not create:
+                return None
+            record = self._records[key] = TTLRecord()
+        else:
+            self._records.move_to_end(key)
+        record.expires = now + self.ttl
+        return record
+
+    def _drop_empty(self, key: StorageKey, record: TTLRecord):
+        if record.state is None and not record.blob:
+            del self._records[key]
+
+    def _expire(self, now: float):
+        # records are kept in access order, so the expired ones are at the front
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires > now:
+                break
+            self._remove(key)
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._records) > 1:
+            self._remove(next(iter(self._records)))
+
+    def _remove(self, key: StorageKey):
+        record = self._records.pop(key)
+        self._bytes -= len(record.blob)
+
+# ================ SQLITE
+
+class SQLiteStorage(BaseStorage):
+    """
+    Persistent FSM storage in a local SQLite database (WAL mode), so that
+    restarts keep the conversations and several bot processes can share them.
+    Entries expire `ttl` seconds after the last access, like TTLMemoryStorage.
+    The state holds private keys and passwords: the database is only readable
+    by the bot's user.
+    """
+
+    def __init__(self, path: str = None, ttl: float = 3600):
+        self.path = path or default_db()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(private_file(self.path), check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, '
+                         'data BLOB NOT NULL DEFAULT x\'\', expires REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS fsm_expires ON fsm (expires)')
+
+    @staticmethod
+    def make_key(key: StorageKey) -> str:
+        return f'{key.bot_id}:{key.chat_id}:{key.user_id}:{key.destiny}'
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._close)
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        await asyncio.to_thread(self._write, 'state', self.make_key(key), state_name(state))
+
+    async def get_state(self, bot: Bot, key: StorageKey) -> Optional[str]:
+        row = await asyncio.to_thread(self._read, self.make_key(key))
+        return row[0] if row else None
+
+    async def set_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._write, 'data', self.make_key(key), encode_data(data))
+
+    async def get_data(self, bot: Bot, key: StorageKey) -> Dict[str, Any]:
+        row = await asyncio.to_thread(self._read, self.make_key(key))
+        return decode_data(row[1]) if row else {}
+
+    def _read(self, key: str) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            # sliding TTL: a read keeps the conversation alive as well
+            self._db.execute('UPDATE fsm SET expires = ? WHERE key = ? AND expires > ?', (now + self.ttl, key, now))
+            return self._db.execute('SELECT state, data FROM fsm WHERE key = ? AND expires > ?',
+                                    (key, now)).fetchone()
+
+    def _write(self, column: str, key: str, value):
+        now = time.time()
+        with self._lock:
+            db = self._db
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                # an expired row must not leak its old state / data into the new one
+                db.execute('DELETE FROM fsm WHERE key = ? AND expires <= ?', (key, now))
+                db.execute(f'INSERT INTO fsm (key, {column}, expires) VALUES (?, ?, ?) '
+                           f'ON CONFLICT (key) DO UPDATE SET {column} = excluded.{column}, '
+                           f'expires = excluded.expires', (key, value, now + self.ttl))
+                db.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = x''", (key,))
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    db.execute('DELETE FROM fsm WHERE expires <= ?', (now,))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def _close(self):
+        with self._lock:
+            self._db.close()
+
+# ============================================================ #
+
+def default_db() -> str:
+    # outside the working directory, which may be shared or served
+    state = os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+    return os.path.join(state, 'openssl-bot', 'fsm.sqlite')
+
+def private_file(path: str) -> str:
+    """
+    Create the database file (and a missing directory) for the owner only.
+    SQLite creates its -wal / -shm files with the mode of the database.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder, mode=0o700)
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    for name in (path, f'{path}-wal', f'{path}-shm'):
+        if os.path.exists(name):
+            # an older database may have been created with the default umask
+            os.chmod(name, 0o600)
+    return path
+
+def make_storage() -> BaseStorage:
+    if CONFIG.fsm_storage == 'sqlite':
+        return SQLiteStorage(CONFIG.fsm_db, CONFIG.fsm_ttl)
+    if CONFIG.fsm_storage == 'memory':
+        return TTLMemoryStorage(CONFIG.fsm_ttl, CONFIG.fsm_max_bytes)
+    raise Exception(f'Unknown FSM storage "{CONFIG.fsm_storage}", use one of: memory, sqlite')
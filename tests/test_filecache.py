@@ -0,0 +1,132 @@
+"""
+filecache.FileCache: private keys are never cached, uploads are found by
+their file_unique_id (through the local fake Telegram API, bench.fakeapi)
+and forgotten once evicted, the LRU stays within its byte budget and check
+results expire.
+
+    python -m pytest tests
+"""
+import asyncio, tempfile, time, unittest
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.types import Document
+
+from bench import make_material
+from bench.fakeapi import FakeTelegram, FakeSession
+from filecache import FileCache
+import filecache
+
+# ============================================================ #
+
+TOKEN = '123456:TEST-TOKEN'
+
+# ============================================================ #
+
+class FileCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as tmp:
+            cls.material = make_material(Path(tmp), 'ec256', 1)
+
+    def test_private_key_not_cached(self):
+        cache = FileCache()
+        # a key alone, a key glued to the certificate and the other PEM labels
+        texts = [self.material['key'], self.material['crt'] + self.material['key'],
+                 self.material['key'].replace('PRIVATE KEY', 'EC PRIVATE KEY'),
+                 self.material['key'].replace('PRIVATE KEY', 'ENCRYPTED PRIVATE KEY')]
+        for i, text in enumerate(texts):
+            with self.subTest(i=i):
+                self.assertIsNone(cache.put(text))
+                self.assertIsNone(cache.add_upload(f'key{i}', text))
+                self.assertIsNone(cache.upload(f'key{i}'))
+        self.assertEqual((cache.count, cache.size), (0, 0))
+
+    def test_same_text_stored_once(self):
+        cache = FileCache()
+        digest = cache.put(self.material['crt'])
+        self.assertEqual(cache.add_upload('u1', self.material['crt']), digest)
+        self.assertEqual(cache.add_upload('u2', self.material['crt']), digest)
+        self.assertEqual((cache.count, cache.size), (1, len(self.material['crt'])))
+        self.assertEqual(cache.get(digest), self.material['crt'])
+
+    def test_lru(self):
+        texts = [f'text {i} ' + 'x' * 92 for i in range(4)]
+        cache = FileCache(max_bytes=300)
+        a, b, c = (cache.add_upload(f'u{i}', t) for i, t in enumerate(texts[:3]))
+        # a read makes `a` the most recently used
+        self.assertEqual(cache.get(a), texts[0])
+        cache.put(texts[3])
+        self.assertLessEqual(cache.size, 300)
+        self.assertIsNone(cache.get(b))
+        # the upload of an evicted text is forgotten, the others are still found
+        self.assertIsNone(cache.upload('u1'))
+        self.assertEqual([cache.upload('u0'), cache.upload('u2')], [a, c])
+
+    def test_entry_over_budget(self):
+        # the newest text is kept even if it alone is over the budget
+        cache = FileCache(max_bytes=10)
+        cache.put('x' * 5)
+        digest = cache.put('y' * 50)
+        self.assertEqual(cache.count, 1)
+        self.assertEqual(cache.get(digest), 'y' * 50)
+
+    def test_results(self):
+        cache = FileCache(result_ttl=3600)
+        digest = cache.put(self.material['crt'])
+        self.assertEqual(cache.store_result(digest, 'check', 'ok'), 'ok')
+        self.assertEqual(cache.result(digest, 'check'), 'ok')
+        self.assertIsNone(cache.result(digest, 'other'))
+        # a result expires at the earlier of its own expiry and the cache TTL
+        cache.store_result(digest, 'cert', 'valid', expires=time.time() - 1)
+        self.assertIsNone(cache.result(digest, 'cert'))
+        cache.result_ttl = -1
+        cache.store_result(digest, 'check', 'ok')
+        self.assertIsNone(cache.result(digest, 'check'))
+        # no results for a text that is not cached
+        self.assertEqual(cache.store_result('missing', 'check', 'ok'), 'ok')
+        self.assertIsNone(cache.result('missing', 'check'))
+
+class DownloadTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.material = make_material(Path(tmp), 'ec256', 1)
+        self.saved = filecache.CACHE
+        filecache.CACHE = FileCache()
+        self.api = FakeTelegram(TOKEN)
+        self.bot = Bot(TOKEN, session=FakeSession(self.api))
+
+    async def asyncTearDown(self):
+        filecache.CACHE = self.saved
+
+    def document(self, name: str, text: str) -> Document:
+        return Document(**self.api.add_file(name, text.encode('utf-8')))
+
+    async def test_found_by_unique_id(self):
+        crt = self.material['crt']
+        first = await filecache.download_document(self.bot, self.document('a.crt', crt))
+        # the same file sent again, by another user and under another name
+        second = await filecache.download_document(self.bot, self.document('b.crt', crt))
+        self.assertEqual(first, second)
+        self.assertEqual(first[0], crt)
+        self.assertEqual(self.api.calls['getFile'], 1)
+
+    async def test_concurrent_download_shared(self):
+        document = self.document('a.crt', self.material['crt'])
+        results = await asyncio.gather(*(filecache.download_document(self.bot, document) for _ in range(3)))
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(self.api.calls['getFile'], 1)
+
+    async def test_key_downloaded_every_time(self):
+        document = self.document('a.key', self.material['key'])
+        for _ in range(2):
+            text, digest = await filecache.download_document(self.bot, document, 'PRIVATE KEY')
+            self.assertEqual(text, self.material['key'])
+            self.assertIsNone(digest)
+        self.assertEqual(self.api.calls['getFile'], 2)
+        self.assertEqual(filecache.CACHE.count, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+jobs.JobScheduler: round-robin dispatch between users, queue positions,
+the per-user and global queue limits and cancellation of queued jobs.
+
+    python -m pytest tests
+"""
+import asyncio, threading, unittest
+
+from jobs import JobScheduler, QueueFullError
+
+# ============================================================ #
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.done: list[str] = []
+        # the first job holds the only worker until `gate` is set
+        self.gate = threading.Event()
+
+    async def asyncTearDown(self):
+        self.gate.set()
+        self.scheduler.shutdown()
+
+    def make(self, max_queue: int = 100, max_user_queue: int = 5) -> JobScheduler:
+        self.scheduler = JobScheduler(1, max_queue, max_user_queue)
+        self.blocker = self.scheduler.submit('blocker', self.gate.wait, 5)
+        return self.scheduler
+
+    def job(self, name: str):
+        self.done.append(name)
+        return name
+
+    async def test_starts_at_once_when_idle(self):
+        scheduler = JobScheduler(2)
+        job = scheduler.submit('a', self.job, 'a1')
+        self.assertEqual(job.position, 0)
+        self.assertEqual(await job, 'a1')
+        self.scheduler = scheduler
+
+    async def test_round_robin(self):
+        scheduler = self.make()
+        jobs = [scheduler.submit(user, self.job, name) for user, name in
+                (('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), ('b', 'b2'), ('c', 'c1'))]
+        # a user with many jobs takes turns with the others
+        self.assertEqual({j.args[0]: scheduler.position(j) for j in jobs},
+                         {'a1': 1, 'b1': 2, 'c1': 3, 'a2': 4, 'b2': 5, 'a3': 6})
+        self.assertEqual(scheduler.pending, 6)
+        self.gate.set()
+        await asyncio.gather(*jobs)
+        self.assertEqual(self.done, ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+        self.assertEqual((scheduler.pending, scheduler.running), (0, 0))
+
+    async def test_position_when_submitted(self):
+        scheduler = self.make()
+        self.assertEqual(scheduler.submit('a', self.job, 'a1').position, 1)
+        self.assertEqual(scheduler.submit('a', self.job, 'a2').position, 2)
+        # b1 goes before a2
+        self.assertEqual(scheduler.submit('b', self.job, 'b1').position, 2)
+
+    async def test_user_limit(self):
+        scheduler = self.make(max_user_queue=2)
+        scheduler.submit('a', self.job, 'a1')
+        scheduler.submit('a', self.job, 'a2')
+        with self.assertRaisesRegex(QueueFullError, 'this user'):
+            scheduler.submit('a', self.job, 'a3')
+        # other users are not affected
+        scheduler.submit('b', self.job, 'b1')
+
+    async def test_queue_limit(self):
+        scheduler = self.make(max_queue=3)
+        for user in 'abc':
+            scheduler.submit(user, self.job, user)
+        with self.assertRaisesRegex(QueueFullError, 'queue is full'):
+            scheduler.submit('d', self.job, 'd')
+
+    async def test_cancelled_job_is_skipped(self):
+        scheduler = self.make()
+        a1 = scheduler.submit('a', self.job, 'a1')
+        b1 = scheduler.submit('b', self.job, 'b1')
+        a1.future.cancel()
+        self.gate.set()
+        await b1
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.done, ['b1'])
+        self.assertEqual(scheduler.pending, 0)
+
+    async def test_exception_is_passed_on(self):
+        scheduler = JobScheduler(1)
+        with self.assertRaisesRegex(ValueError, 'boom'):
+            await scheduler.submit('a', int, 'boom')
+        self.scheduler = scheduler
+
+    async def test_shutdown_cancels_pending(self):
+        scheduler = self.make()
+        job = scheduler.submit('a', self.job, 'a1')
+        scheduler.shutdown()
+        self.assertTrue(job.future.cancelled())
+        self.assertEqual(scheduler.pending, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+PEM bundles through ossl.process_pem and into a PKCS12: the certificates of
+a chain must come out one by one, neither glued together nor corrupted,
+whatever the line endings and the text around them.
+
+    python -m pytest tests
+"""
+import shutil, tempfile, unittest
+from pathlib import Path
+
+from bench import make_material
+import ossl
+
+# ============================================================ #
+
+PASSWORD = 'test-pw'
+
+# ============================================================ #
+
+def fingerprints(pem: bytes) -> list[str]:
+    return [ossl.cert_fingerprint(ossl.block_der(pem, b)) for b in ossl.parse_pem(pem) if b.kind == ossl.KIND_CERT]
+
+def messy(pems: list[str]) -> str:
+    # a hand-made fullchain file: CRLF, blank lines, text before, between and after the blocks
+    text = 'Subject: leaf\n\n' + '\n\n# intermediate\n'.join(pems) + '\nend of chain\n'
+    return text.replace('\n', '\r\n')
+
+@unittest.skipUnless(shutil.which('openssl'), 'openssl is not installed')
+class ChainTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as tmp:
+            cls.material = make_material(Path(tmp), 'ec256', 2)
+        blocks = [cls.material['crt']] + ['-----BEGIN CERTIFICATE-----' + p for p in
+                                          cls.material['chain'].split('-----BEGIN CERTIFICATE-----')[1:]]
+        cls.chain = messy(blocks)
+        cls.expected = fingerprints(''.join(blocks).encode(ossl.ENC))
+
+    def test_process_pem(self):
+        pem = ossl.process_pem(self.chain, 'chain', (ossl.KIND_CERT,))
+        self.assertEqual(pem.count(b'-----BEGIN CERTIFICATE-----'), 3)
+        self.assertNotIn(b'\r', pem)
+        self.assertEqual(fingerprints(pem), self.expected)
+
+    def test_pkcs12(self):
+        for backend, impl in ossl.BACKENDS.items():
+            if not impl.available():
+                continue
+            with self.subTest(backend=backend):
+                data = ossl.make_pkcs12(None, self.chain, self.material['key'], 'test', PASSWORD, backend=backend)
+                has_key, fps, _ = ossl.verify_pkcs12(data, PASSWORD)
+                self.assertTrue(has_key)
+                self.assertEqual(fps, sorted(self.expected))
+
+if __name__ == '__main__':
+    unittest.main()
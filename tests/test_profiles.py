@@ -0,0 +1,60 @@
+"""
+PKCS12 profiles (ossl.PROFILES) against the capabilities of the installed
+OpenSSL: a profile the backend exporting with it cannot run is rejected by
+ossl.check_profile and left out of ossl.usable_profiles.
+
+    python -m pytest tests
+"""
+import tempfile, unittest
+from pathlib import Path
+from unittest import mock
+
+from bench import make_material
+import ossl
+
+# ============================================================ #
+
+# "openssl pkcs12 -help" of 1.1.1: no -iter
+OSSL_1 = ossl.OsslCaps('openssl', 0, 0, 'OpenSSL 1.1.1w  11 Sep 2023', (1, 1, 1),
+                       frozenset(('-export', '-keypbe', '-certpbe', '-macalg', '-name', '-passout')))
+
+# ============================================================ #
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(ossl, 'get_caps', return_value=OSSL_1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cli_without_iter(self):
+        with self.assertRaisesRegex(Exception, 'does not support -iter'):
+            ossl.check_profile('modern', 'pw', 'cli')
+        # the 2048 iterations of the others are the 1.x default
+        self.assertEqual(ossl.usable_profiles('pw', 'cli'), ['default', 'legacy-compatible', 'fast'])
+
+    @unittest.skipIf(ossl.pkcs12 is None, 'cryptography is not installed')
+    def test_auto(self):
+        # cryptography runs every profile with a password, the CLI takes the exports without one
+        self.assertEqual(ossl.usable_profiles('pw', 'auto'), list(ossl.PROFILES))
+        self.assertEqual(ossl.usable_profiles(None, 'auto'), ['default', 'legacy-compatible', 'fast'])
+        self.assertEqual(ossl.check_profile('modern', 'pw', 'auto'), ossl.PROFILES['modern'])
+
+    def test_unknown(self):
+        with self.assertRaisesRegex(Exception, 'Unknown PKCS12 profile'):
+            ossl.check_profile('strong')
+
+@unittest.skipUnless(ossl.check_ossl(), 'openssl is not installed')
+class InstalledTest(unittest.TestCase):
+
+    def test_usable_profiles_export(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            m = make_material(Path(tmp), 'ec256', 1)
+        # whatever check_profile lets through must export on this OpenSSL
+        for name in ossl.usable_profiles('pw', 'cli'):
+            with self.subTest(profile=name):
+                data = ossl.make_pkcs12(m['crt'], m['chain'], m['key'], 'test', 'pw', backend='cli', profile=name)
+                self.assertTrue(ossl.verify_pkcs12(data, 'pw')[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+ratelimit.RateLimiter against the local fake Telegram API enforcing the
+documented flood limits (bench.fakeapi.TELEGRAM_LIMITS): no 429 under a burst,
+retry_after honoured when Telegram is stricter than the limiter and stale
+chat actions dropped instead of sent.
+
+    python -m pytest tests
+"""
+import asyncio, time, unittest
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from bench.fakeapi import FakeTelegram, FakeSession, TELEGRAM_LIMITS
+import ratelimit
+
+# ============================================================ #
+
+TOKEN = '123456:TEST-TOKEN'
+
+# ============================================================ #
+
+class RateLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+    def make(self, limited: bool = True, limits: dict = TELEGRAM_LIMITS, **kwargs) -> Bot:
+        self.api = FakeTelegram(TOKEN, limits=limits)
+        bot = Bot(TOKEN, session=FakeSession(self.api))
+        if limited:
+            bot.session.middleware(ratelimit.RateLimiter(**kwargs))
+        return bot
+
+    async def burst(self, bot: Bot, chats: int, messages: int):
+        await asyncio.gather(*(bot.send_message(1000 + c, f'm{m}') for m in range(messages) for c in range(chats)))
+
+    async def test_burst_without_floods(self):
+        # more than the 3-message burst of a private chat: the fake would refuse the rest
+        with self.assertRaises(TelegramRetryAfter):
+            await self.burst(self.make(limited=False), 1, 5)
+        self.assertGreater(self.api.floods, 0)
+
+        bot = self.make()
+        await asyncio.wait_for(self.burst(bot, 4, 5), 10)
+        self.assertEqual(self.api.floods, 0)
+        self.assertEqual(self.api.count('sendMessage'), 20)
+        # every chat got its messages in order
+        for c in range(4):
+            self.assertEqual([r[3] for r in self.api.replies[1000 + c]], [f'm{m}' for m in range(5)])
+
+    async def test_retry_after(self):
+        # Telegram allows one message per second with no burst, the limiter thinks it may send 3 at once
+        limits = dict(TELEGRAM_LIMITS, private=(1, 1))
+        bot = self.make(limits=limits)
+        waits = ratelimit.FLOOD_WAITS.labels().value
+        start = time.monotonic()
+        await asyncio.wait_for(self.burst(bot, 1, 2), 10)
+        # the second message was refused once and sent again only after retry_after (1 s)
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertEqual(self.api.floods, 1)
+        self.assertEqual(ratelimit.FLOOD_WAITS.labels().value - waits, 1)
+        self.assertEqual(self.api.count('sendMessage'), 2)
+
+    async def test_retries_exhausted(self):
+        bot = self.make(limits=dict(TELEGRAM_LIMITS, private=(0.5, 1)), retries=0)
+        with self.assertRaises(TelegramRetryAfter):
+            await asyncio.wait_for(self.burst(bot, 1, 2), 10)
+        self.assertEqual(self.api.count('sendMessage'), 1)
+
+    async def test_stale_action_dropped(self):
+        bot = self.make()
+        dropped = ratelimit.ACTIONS_DROPPED.labels().value
+        await self.burst(bot, 1, 3)
+        # the chat has no spare token for the next 2 s: the action would be stale before it is sent
+        start = time.monotonic()
+        self.assertTrue(await bot.send_chat_action(1000, 'typing'))
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(ratelimit.ACTIONS_DROPPED.labels().value - dropped, 1)
+        self.assertEqual(self.api.calls['sendChatAction'], 0)
+        self.assertEqual(self.api.floods, 0)
+
+    async def test_action_superseded_by_message(self):
+        bot = self.make(action_stale=5)
+        dropped = ratelimit.ACTIONS_DROPPED.labels().value
+        await self.burst(bot, 1, 3)
+        # the action queues, then a message for the same chat goes first: the action is moot
+        action = asyncio.create_task(bot.send_chat_action(1000, 'typing'))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(bot.send_message(1000, 'm3'), 5)
+        self.assertTrue(await asyncio.wait_for(action, 1))
+        self.assertEqual(ratelimit.ACTIONS_DROPPED.labels().value - dropped, 1)
+        self.assertEqual(self.api.calls['sendChatAction'], 0)
+        self.assertEqual(self.api.count('sendMessage'), 4)
+        self.assertEqual(self.api.floods, 0)
+
+if __name__ == '__main__':
+    unittest.main()
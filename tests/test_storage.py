@@ -0,0 +1,109 @@
+"""
+FSM storages: sliding expiry in both backends, LRU eviction of the memory
+backend within its byte budget, no state / data leaking from an expired
+SQLite row and the database file being private.
+
+    python -m pytest tests
+"""
+import asyncio, os, stat, tempfile, unittest
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import SQLiteStorage, TTLMemoryStorage, encode_data
+
+# ============================================================ #
+
+TTL = 0.3
+
+def key(user: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user, user_id=user)
+
+# ============================================================ #
+
+class ExpiryMixin:
+
+    def make(self, ttl: float = TTL):
+        raise NotImplementedError
+
+    async def test_sliding_expiry(self):
+        storage = self.make()
+        await storage.set_state(None, key(1), 'state')
+        await storage.set_data(None, key(1), {'pw': 'secret'})
+        # reads keep the entry alive well past one TTL
+        for _ in range(4):
+            await asyncio.sleep(TTL / 2)
+            self.assertEqual(await storage.get_data(None, key(1)), {'pw': 'secret'})
+        self.assertEqual(await storage.get_state(None, key(1)), 'state')
+        await asyncio.sleep(TTL * 1.5)
+        self.assertIsNone(await storage.get_state(None, key(1)))
+        self.assertEqual(await storage.get_data(None, key(1)), {})
+
+    async def test_no_leak_after_expiry(self):
+        storage = self.make()
+        await storage.set_state(None, key(1), 'old')
+        await storage.set_data(None, key(1), {'priv': 'old key'})
+        await asyncio.sleep(TTL * 1.5)
+        # a new conversation must not get the data of the expired one
+        await storage.set_state(None, key(1), 'new')
+        self.assertEqual(await storage.get_data(None, key(1)), {})
+        await storage.set_data(None, key(1), {'name': 'new'})
+        self.assertEqual(await storage.get_state(None, key(1)), 'new')
+        self.assertEqual(await storage.get_data(None, key(1)), {'name': 'new'})
+
+class MemoryStorageTest(ExpiryMixin, unittest.IsolatedAsyncioTestCase):
+
+    def make(self, ttl: float = TTL, max_bytes: int = 1024 * 1024) -> TTLMemoryStorage:
+        return TTLMemoryStorage(ttl, max_bytes)
+
+    async def test_lru_eviction(self):
+        data = {'v': 'x' * 30}
+        # room for three entries
+        storage = self.make(3600, 3 * len(encode_data(data)))
+        for user in range(3):
+            await storage.set_data(None, key(user), data)
+        self.assertEqual(storage.count, 3)
+        # a read makes user 0 the most recently used
+        await storage.get_data(None, key(0))
+        await storage.set_data(None, key(3), data)
+        self.assertLessEqual(storage.size, storage.max_bytes)
+        self.assertEqual(await storage.get_data(None, key(1)), {})
+        for user in (0, 2, 3):
+            self.assertEqual(await storage.get_data(None, key(user)), data)
+
+    async def test_empty_entries_are_dropped(self):
+        storage = self.make()
+        await storage.set_state(None, key(1), 'state')
+        await storage.set_data(None, key(1), {'v': 1})
+        await storage.set_state(None, key(1), None)
+        await storage.set_data(None, key(1), {})
+        self.assertEqual((storage.count, storage.size), (0, 0))
+
+class SQLiteStorageTest(ExpiryMixin, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storages = []
+
+    async def asyncTearDown(self):
+        for storage in self.storages:
+            await storage.close()
+        self.tmp.cleanup()
+
+    def make(self, ttl: float = TTL) -> SQLiteStorage:
+        storage = SQLiteStorage(os.path.join(self.tmp.name, 'state', 'fsm.sqlite'), ttl)
+        self.storages.append(storage)
+        return storage
+
+    async def test_private_file(self):
+        storage = self.make()
+        await storage.set_data(None, key(1), {'priv': 'key'})
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(storage.path)).st_mode), 0o700)
+        for name in (storage.path, f'{storage.path}-wal', f'{storage.path}-shm'):
+            self.assertEqual(stat.S_IMODE(os.stat(name).st_mode), 0o600, name)
+
+    async def test_shared_between_instances(self):
+        await self.make().set_data(None, key(1), {'v': 1})
+        self.assertEqual(await self.make().get_data(None, key(1)), {'v': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Webhook mode against the local fake Telegram API (bench.fakeapi): the secret
+token check, acking updates before they are handled and draining the
+updates in progress on shutdown.
+
+    python -m pytest tests
+"""
+import asyncio, unittest
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from pydantic import SecretStr
+
+from bench.fakeapi import FakeTelegram, FakeSession
+from config import CONFIG
+import webhook
+
+# ============================================================ #
+
+TOKEN = '123456:TEST-TOKEN'
+SECRET = 'test-secret'
+
+# ============================================================ #
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.saved = CONFIG.webhook_secret, CONFIG.webhook_path
+        CONFIG.webhook_secret, CONFIG.webhook_path = SecretStr(SECRET), '/webhook'
+        self.api = FakeTelegram(TOKEN)
+        self.bot = Bot(TOKEN, session=FakeSession(self.api))
+        self.dp = Dispatcher()
+        # handlers wait for `release`, `handled` counts the finished ones
+        self.release = asyncio.Event()
+        self.handled = 0
+
+        @self.dp.message()
+        async def answer(message: Message, bot: Bot):
+            await self.release.wait()
+            await bot.send_message(message.chat.id, 'done')
+            self.handled += 1
+
+        self.runner = web.AppRunner(webhook.make_app(self.dp, self.bot), handle_signals=False)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook'
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await self.runner.cleanup()
+        CONFIG.webhook_secret, CONFIG.webhook_path = self.saved
+
+    def updates(self, n: int = 1) -> list:
+        return [self.api.make_update(1000 + i, 'hello') for i in range(n)]
+
+    async def test_wrong_secret(self):
+        for secret in ('wrong', None):
+            with self.assertRaisesRegex(Exception, 'answered 401'):
+                await self.api.push(self.url, self.updates(), secret)
+        self.release.set()
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.handled, 0)
+        self.assertEqual(self.api.count('sendMessage'), 0)
+
+    async def test_ack_before_handling(self):
+        # push returns once every update got its 200, while all handlers are still waiting
+        await asyncio.wait_for(self.api.push(self.url, self.updates(5), SECRET), 5)
+        self.assertEqual(self.handled, 0)
+        self.release.set()
+        await self.api.wait_sent(5, 'sendMessage', timeout=5)
+        self.assertEqual(self.handled, 5)
+
+    async def test_drain_on_shutdown(self):
+        await self.api.push(self.url, self.updates(3), SECRET)
+        self.assertEqual(self.handled, 0)
+        asyncio.get_running_loop().call_later(0.2, self.release.set)
+        # what webhook.serve does when it is stopped
+        await self.runner.cleanup()
+        self.assertEqual(self.handled, 3)
+        self.assertEqual(self.api.count('sendMessage'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+"""
+Checks of the uploaded material as soon as each file arrives: PEM format,
+validity dates, key <-> certificate match and the chain order / signatures.
+The normalized PEM and the parsed metadata are kept in the FSM state, so the
+export neither parses the files again nor fails late on a mismatch.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+import batch
+import ossl
+
+# ============================================================ #
+
+class ValidationError(Exception):
+    pass
+
+# ============================================================ #
+
+def cert_meta(info: ossl.CertInfo) -> dict:
+    # JSON-friendly subset of CertInfo for the FSM state
+    return {'subject': info.subject, 'issuer': info.issuer, 'name': info.common_name,
+            'fingerprint': info.fingerprint, 'key_fingerprint': info.key_fingerprint,
+            'not_before': info.not_before.isoformat(), 'not_after': info.not_after.isoformat(),
+            'is_ca': info.is_ca, 'ski': info.ski, 'aki': info.aki}
+
+def meta_info(meta: dict, pem: bytes) -> ossl.CertInfo:
+    # the CertInfo behind cert_meta, without parsing the certificate again
+    return ossl.CertInfo(meta['subject'], meta['issuer'], datetime.fromisoformat(meta['not_before']),
+                         datetime.fromisoformat(meta['not_after']), meta['fingerprint'], meta['key_fingerprint'],
+                         meta['is_ca'], pem, meta['ski'], meta['aki'])
+
+def check_dates(info: ossl.CertInfo, what: str = 'Сертификат'):
+    now = datetime.now(timezone.utc)
+    if info.not_after <= now:
+        raise ValidationError(f'{what} "{info.common_name}" истёк {info.not_after:%d.%m.%Y}')
+    if info.not_before > now:
+        raise ValidationError(f'{what} "{info.common_name}" начнёт действовать только {info.not_before:%d.%m.%Y}')
+
+def read_blocks(text: ossl.PemType, filename: str, kind: str) -> list[bytes]:
+    data = ossl.pem_to_bytes(text, filename)
+    try:
+        blocks = ossl.parse_pem(data)
+    except Exception as err:
+        raise ValidationError(f'Неверный формат PEM: {str(err)}')
+    pems = [ossl.format_block(data, b) for b in blocks if b.kind == kind]
+    if not pems:
+        raise ValidationError('В файле нет ' + ('сертификатов' if kind == ossl.KIND_CERT else 'приватного ключа'))
+    return pems
+
+def inspect_all(pems: list[bytes]) -> list[ossl.CertInfo]:
+    try:
+        return [ossl.inspect_cert(pem) for pem in pems]
+    except Exception as err:
+        raise ValidationError(f'Не удалось прочитать сертификат: {str(err)}')
+
+def pem_fingerprints(text: ossl.PemType) -> list[str]:
+    # SHA256 of every certificate in a PEM file, without parsing them
+    data = ossl.pem_to_bytes(text, 'crt')
+    return [ossl.cert_fingerprint(ossl.block_der(data, b)) for b in ossl.parse_pem(data) if b.kind == ossl.KIND_CERT]
+
+def parse_certs(text: ossl.PemType, filename: str = 'pem') -> list[ossl.CertInfo]:
+    return inspect_all(read_blocks(text, filename, ossl.KIND_CERT))
+
+def valid_until(meta: dict) -> float:
+    # a check result holds until the first of its certificates expires (unix time)
+    certs = meta.get('certs') or [meta]
+    return min(datetime.fromisoformat(m['not_after']).timestamp() for m in certs)
+
+# ================ UPLOADS
+
+def check_cert(text: ossl.PemType, key_fp: Optional[str] = None) -> dict:
+    """
+    Certificate file: the first certificate is the leaf (the rest of a
+    fullchain file is passed along as is). Returns {'pem', 'meta'}.
+    """
+    pems = read_blocks(text, 'crt', ossl.KIND_CERT)
+    leaf = inspect_all(pems[:1])[0]
+    check_dates(leaf)
+    if key_fp and leaf.key_fingerprint != key_fp:
+        raise ValidationError('Сертификат не соответствует загруженному приватному ключу')
+    return {'pem': b''.join(pems).decode(ossl.ENC), 'meta': cert_meta(leaf)}
+
+def check_key(text: ossl.PemType, cert_key_fp: Optional[str] = None) -> dict:
+    """
+    Private key file: one unencrypted key. Returns {'pem', 'fingerprint'}.
+    """
+    pems = read_blocks(text, 'key', ossl.KIND_KEY)
+    if len(pems) > 1:
+        raise ValidationError('В файле несколько приватных ключей, отправьте один')
+    try:
+        fp = ossl.key_fingerprint(pems[0])
+    except Exception as err:
+        raise ValidationError(f'Ключ повреждён или зашифрован паролем: {str(err)}')
+    if cert_key_fp and fp != cert_key_fp:
+        raise ValidationError('Приватный ключ не соответствует сертификату (разные открытые ключи)')
+    return {'pem': pems[0].decode(ossl.ENC), 'fingerprint': fp}
+
+def check_chain(text: ossl.PemType, leaf_pem: ossl.PemType = None, key_fp: Optional[str] = None,
+                infos: list[ossl.CertInfo] = None, leaf_meta: dict = None) -> dict:
+    """
+    Chain file: order the CA certificates from the leaf up and verify every
+    signature on the way. Without a separate leaf cert the chain must contain
+    it (the one matching the key) and the ordered chain starts with it; with
+    neither a leaf nor a key (a trust bundle) there is nothing to anchor a
+    path to and every certificate is kept. Certificates unrelated to the leaf
+    are dropped, repeated ones (also those already in the certificate file)
+    are removed. `infos` are the already parsed certificates of `text` (see
+    filecache.parsed_certs), `leaf_meta` the cert_meta of `leaf_pem`.
+    Returns {'pem', 'meta': {'certs', 'with_leaf'}, 'dropped', 'duplicates'}.
+    """
+    infos = infos or parse_certs(text)
+    unique: dict[str, ossl.CertInfo] = {}
+    for info in infos:
+        unique.setdefault(info.fingerprint, info)
+    entries = [batch.CertEntry('chain', info) for info in unique.values()]
+
+    if leaf_pem is None and not key_fp:
+        for e in entries:
+            check_dates(e.info, 'Сертификат цепочки')
+        return {'pem': b''.join(e.info.pem for e in entries).decode(ossl.ENC),
+                'meta': {'certs': [cert_meta(e.info) for e in entries], 'with_leaf': False},
+                'dropped': 0, 'duplicates': len(infos) - len(entries)}
+
+    with_leaf = leaf_pem is None
+    if with_leaf:
+        matches = [e for e in entries if e.info.key_fingerprint == key_fp]
+        if not matches:
+            raise ValidationError('В цепочке нет сертификата, соответствующего приватному ключу')
+        start = max(matches, key=lambda e: e.info.not_after)
+        check_dates(start.info)
+    else:
+        # already checked at upload: rebuilt from its metadata, not parsed again
+        leaf = read_blocks(leaf_pem, 'crt', ossl.KIND_CERT)[0]
+        start = batch.CertEntry('crt', meta_info(leaf_meta, leaf) if leaf_meta and 'not_before' in leaf_meta
+                                else inspect_all([leaf])[0])
+    start_info = start.info
+
+    by_subject: dict[str, list] = {}
+    for e in entries:
+        # a fullchain file repeats the leaf: it is not a CA of itself
+        if e.info.fingerprint != start_info.fingerprint:
+            by_subject.setdefault(e.info.subject, []).append(e)
+    path = batch.build_chain(start, by_subject)
+    if not path and not start_info.self_signed:
+        raise ValidationError(f'Цепочка не содержит издателя сертификата "{start.info.common_name}" '
+                              f'({start_info.issuer})')
+
+    prev = start
+    for e in path:
+        check_dates(e.info, 'Сертификат цепочки')
+        if not ossl.verify_issued(prev.info.pem, e.info.pem):
+            raise ValidationError(f'Подпись сертификата "{prev.info.common_name}" не проверяется '
+                                  f'ключом "{e.info.common_name}"')
+        prev = e
+
+    ordered = ([start] if with_leaf else []) + path
+    used = {e.info.fingerprint for e in ordered} | {start_info.fingerprint}
+    duplicates = len(infos) - len(entries)
+    if not with_leaf:
+        # a fullchain certificate file already holds the leaf and maybe (some of) the chain
+        known = set(pem_fingerprints(leaf_pem))
+        duplicates += sum(1 for e in ordered if e.info.fingerprint in known) + (start_info.fingerprint in unique)
+        ordered = [e for e in ordered if e.info.fingerprint not in known]
+    return {'pem': b''.join(e.info.pem for e in ordered).decode(ossl.ENC),
+            'meta': {'certs': [cert_meta(e.info) for e in ordered], 'with_leaf': with_leaf},
+            'dropped': sum(1 for e in entries if e.info.fingerprint not in used), 'duplicates': duplicates}
+
+def restore(text: ossl.PemType, meta: dict) -> str:
+    """
+    The PEM check_cert / check_chain stored, rebuilt from the original file
+    downloaded again: the certificates of `meta` in their checked order, so
+    the certificates dropped at upload (and a repeated leaf) stay out.
+    """
+    if 'certs' not in meta:
+        # certificate file: taken as is, only reformatted
+        return b''.join(read_blocks(text, 'crt', ossl.KIND_CERT)).decode(ossl.ENC)
+    pems = {info.fingerprint: info.pem for info in parse_certs(text)}
+    try:
+        return b''.join(pems[m['fingerprint']] for m in meta['certs']).decode(ossl.ENC)
+    except KeyError:
+        raise ValidationError('Файл цепочки изменился после проверки, загрузите его заново')
+
+# ================ EXPORT
+
+def has(data: dict, field: str) -> bool:
+    # uploaded files are kept in the file cache, the state only has their reference
+    return bool(data.get(field) or data.get(f'{field}_ref'))
+
+def check_bundle(data: dict):
+    """
+    Last check before the export, on the cached metadata only.
+    """
+    if not has(data, 'crt') and not has(data, 'chain'):
+        raise ValidationError('Нужен хотя бы сертификат или цепочка сертификатов')
+    if data.get('priv') and not has(data, 'crt') and not (data.get('chain_meta') or {}).get('with_leaf'):
+        raise ValidationError('Для приватного ключа не загружен соответствующий сертификат')
+
+def is_normalized(data: dict) -> bool:
+    # every stored file went through the checks above (and so is normalized PEM)
+    return all(not has(data, field) or data.get(meta) for field, meta in
+               (('crt', 'crt_meta'), ('priv', 'priv_fp'), ('chain', 'chain_meta')))
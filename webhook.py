@@ -0,0 +1,137 @@
+import asyncio, hmac, logging, multiprocessing, signal, ssl
+from typing import Callable, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import FSInputFile
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import CONFIG
+import ratelimit
+
+# ============================================================ #
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# how long in-flight updates may finish when the server stops
+DRAIN_TIMEOUT = 30
+
+# ============================================================ #
+
+class SecretRequestHandler(SimpleRequestHandler):
+    """
+    Webhook handler that acks every update at once and processes it in a
+    background task (updates are handled concurrently), and rejects requests
+    without the secret token given to setWebhook. Background tasks are
+    tracked so that they are not garbage collected mid-flight and can finish
+    before the bot session is closed on shutdown.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = None, **data):
+        super().__init__(dispatcher, bot, handle_in_background=True, **data)
+        self.secret_token = secret_token
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        if self._tasks:
+            logging.info(f'Waiting for {len(self._tasks)} update(s) in progress')
+            await asyncio.wait(self._tasks, timeout=DRAIN_TIMEOUT)
+        await super().close()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and \
+            not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret_token):
+            return web.Response(status=401)
+        return await super().handle(request)
+
+    __call__ = handle
+
+def make_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    app = web.Application()
+    SecretRequestHandler(dp, bot, CONFIG.webhook_secret.get_secret_value() if CONFIG.webhook_secret else None) \
+        .register(app, path=CONFIG.webhook_path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+def make_ssl_context() -> Optional[ssl.SSLContext]:
+    # TLS is optional: usually it is terminated by a reverse proxy in front of the bot
+    if not (CONFIG.webhook_cert and CONFIG.webhook_key):
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(CONFIG.webhook_cert, CONFIG.webhook_key)
+    return context
+
+async def register(bot: Bot):
+    # pending updates are kept by Telegram while the bot restarts and delivered afterwards
+    await bot.set_webhook(CONFIG.webhook_url,
+                          certificate=FSInputFile(CONFIG.webhook_cert) if CONFIG.webhook_cert and CONFIG.webhook_upload_cert else None,
+                          max_connections=CONFIG.webhook_max_connections,
+                          secret_token=CONFIG.webhook_secret.get_secret_value() if CONFIG.webhook_secret else None,
+                          drop_pending_updates=False)
+    logging.info(f'Webhook set to {CONFIG.webhook_url}')
+
+async def serve(dp: Dispatcher, bot: Bot, set_webhook: bool = True, stop: asyncio.Event = None):
+    """
+    Run the webhook server until `stop` is set or SIGINT / SIGTERM arrives.
+    SO_REUSEPORT lets several worker processes listen on the same port.
+    """
+    if set_webhook:
+        await register(bot)
+    runner = web.AppRunner(make_app(dp, bot), handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, CONFIG.webhook_host, CONFIG.webhook_port, ssl_context=make_ssl_context(),
+                       reuse_port=CONFIG.webhook_workers > 1 or CONFIG.webhook_reuse_port)
+    await site.start()
+    logging.info(f'Webhook server listening on {CONFIG.webhook_host}:{CONFIG.webhook_port}{CONFIG.webhook_path}')
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+def _worker(entry: Callable, index: int, workers: int):
+    # every process has its own metrics: give each one its own endpoint port
+    if CONFIG.metrics_port:
+        CONFIG.metrics_port += index
+    # the global flood limit is per bot token: split it between the processes
+    for limiter in ratelimit.LIMITERS:
+        limiter.share(workers)
+    asyncio.run(entry())
+
+def run_workers(entry: Callable, bot: Bot, workers: int):
+    """
+    Register the webhook once, then run `entry` (an async main without webhook
+    registration) in `workers` processes sharing the port via SO_REUSEPORT.
+    """
+    if CONFIG.fsm_storage == 'memory':
+        logging.warning('Several webhook workers with in-memory FSM storage: a user may hit '
+                        'a worker without their state, set FSM_STORAGE=sqlite')
+    async def setup():
+        try:
+            await register(bot)
+        finally:
+            await bot.session.close()
+    asyncio.run(setup())
+    procs = [multiprocessing.Process(target=_worker, args=(entry, i, workers), name=f'webhook-{i}') for i in range(workers)]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
@@ -0,0 +1,227 @@
+"""
+Conversion worker daemon: serves ossl.make_pkcs12 over a Unix socket
+from a pool of worker processes, so several bot instances can share one
+CPU-bound conversion tier.
+
+    python worker.py
+
+Protocol (one or more requests per connection, answered in order):
+    request  = !I length + JSON {"crt", "chain", "key", "name", "pw", "normalized", "profile"}
+    response = !BI status, length + body (PKCS12 bytes or UTF-8 error message)
+"""
+import asyncio, json, logging, math, os, struct, signal
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from config import CONFIG
+import ossl
+
+# ============================================================ #
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_BUSY = 2
+REQUEST_HEADER = struct.Struct('!I')
+RESPONSE_HEADER = struct.Struct('!BI')
+MAX_REQUEST = 4 * 1024 * 1024
+FIELDS = ('crt', 'chain', 'key', 'name', 'pw')
+SHUTTING_DOWN = (STATUS_BUSY, b'Worker is shutting down')
+
+# ============================================================ #
+
+class WorkerUnavailable(Exception):
+    pass
+
+def convert_batch(requests: list[dict]) -> list[tuple[int, bytes]]:
+    # runs in a pool process: one IPC round-trip for the whole batch
+    results = []
+    for req in requests:
+        try:
+            results.append((STATUS_OK, ossl.make_pkcs12(*(req.get(f) for f in FIELDS),
+                                                        normalized=bool(req.get('normalized')),
+                                                        profile=req.get('profile'))))
+        except Exception as err:
+            results.append((STATUS_ERROR, str(err).encode(ossl.ENC)))
+    return results
+
+async def read_frame(reader: asyncio.StreamReader, header: struct.Struct) -> tuple:
+    head = await reader.readexactly(header.size)
+    fields = header.unpack(head)
+    if fields[-1] > MAX_REQUEST:
+        raise ValueError(f'Frame too large: {fields[-1]} bytes')
+    return (*fields[:-1], await reader.readexactly(fields[-1]))
+
+# ================ SERVER
+
+class WorkerServer:
+
+    def __init__(self, path: str, procs: int = None, queue_size: int = 100, batch_size: int = 8):
+        self.path = path
+        self.procs = procs or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._batcher: Optional[asyncio.Task] = None
+        # running batches, referenced so that they are not garbage collected
+        self._tasks: set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(self.procs)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), 1)
+            except (OSError, asyncio.TimeoutError):
+                # left over by a daemon that did not stop cleanly
+                os.remove(self.path)
+            else:
+                writer.close()
+                raise Exception(f'Another conversion worker is listening on {self.path}')
+        self.executor = ProcessPoolExecutor(self.procs)
+        self.server = await asyncio.start_unix_server(self.handle, self.path)
+        os.chmod(self.path, 0o600)
+        self._batcher = asyncio.create_task(self.batcher())
+        logging.info(f'Conversion worker listening on {self.path} ({self.procs} processes)')
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+        if self._batcher:
+            self._batcher.cancel()
+        # the clients of queued requests convert in-process instead of waiting for worker_timeout
+        while not self.queue.empty():
+            self.answer([self.queue.get_nowait()], SHUTTING_DOWN)
+        if self.executor:
+            # running conversions are finished and answered, batches not started yet are cancelled
+            await asyncio.to_thread(self.executor.shutdown, cancel_futures=True)
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        if self.server:
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    (payload,) = await read_frame(reader, REQUEST_HEADER)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    req = json.loads(payload)
+                    fut = asyncio.get_running_loop().create_future()
+                    # backpressure: refuse at once instead of queueing without bound
+                    self.queue.put_nowait((req, fut))
+                    status, body = await fut
+                except asyncio.QueueFull:
+                    status, body = STATUS_BUSY, b'Worker queue is full'
+                except ValueError as err:
+                    status, body = STATUS_ERROR, f'Bad request: {str(err)}'.encode(ossl.ENC)
+                writer.write(RESPONSE_HEADER.pack(status, len(body)) + body)
+                await writer.drain()
+        except (ConnectionError, ValueError) as err:
+            logging.warning(f'Worker connection dropped: {str(err)}')
+        finally:
+            writer.close()
+
+    async def batcher(self):
+        while True:
+            batch = []
+            try:
+                batch.append(await self.queue.get())
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                self.answer(batch, SHUTTING_DOWN)
+                raise
+            # one IPC round-trip for what queued up while the processes were busy, but only
+            # a fair share of it: the other processes must get work too, not sit idle
+            limit = min(self.batch_size, math.ceil((len(batch) + self.queue.qsize()) / self.procs))
+            while len(batch) < limit:
+                batch.append(self.queue.get_nowait())
+            task = asyncio.create_task(self.run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def run_batch(self, batch: list):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, convert_batch, [req for req, _ in batch])
+        except asyncio.CancelledError:
+            # the executor was shut down before the batch started
+            results = [SHUTTING_DOWN] * len(batch)
+        except Exception as err:
+            logging.exception(err)
+            results = [(STATUS_ERROR, str(err).encode(ossl.ENC))] * len(batch)
+        finally:
+            self._slots.release()
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
+
+    @staticmethod
+    def answer(batch: list, result: tuple):
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_result(result)
+
+# ================ CLIENT
+
+async def convert(path: str, cert: ossl.PemType, certchain: ossl.PemType, key: ossl.PemType,
+                  name: str = None, password: str = None, timeout: float = None, normalized: bool = False,
+                  profile: str = None) -> bytes:
+    """
+    Send one conversion to the worker daemon. Raises WorkerUnavailable if the
+    daemon is down or busy (the caller should convert in-process) and a plain
+    Exception with the conversion error otherwise, or on a timeout: the
+    daemon may still be running the job, converting it again would double it.
+    """
+    values = [ossl.pem_to_bytes(v, f).decode(ossl.ENC) if f in ('crt', 'chain', 'key') and v is not None else v
+              for f, v in zip(FIELDS, (cert, certchain, key, name, password))]
+    payload = json.dumps(dict(zip(FIELDS, values), normalized=normalized, profile=profile),
+                         separators=(',', ':')).encode(ossl.ENC)
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), 1)
+    except (OSError, asyncio.TimeoutError) as err:
+        raise WorkerUnavailable(f'Cannot connect to worker at {path}: {err}')
+    timeout = timeout or CONFIG.worker_timeout
+    try:
+        writer.write(REQUEST_HEADER.pack(len(payload)) + payload)
+        await writer.drain()
+        status, body = await asyncio.wait_for(read_frame(reader, RESPONSE_HEADER), timeout)
+    except asyncio.TimeoutError:
+        raise Exception(f'Worker at {path} did not answer in {timeout} s')
+    except (OSError, asyncio.IncompleteReadError, ValueError) as err:
+        raise WorkerUnavailable(f'Worker at {path} failed: {err!r}')
+    finally:
+        writer.close()
+    if status == STATUS_BUSY:
+        raise WorkerUnavailable(body.decode(ossl.ENC))
+    if status != STATUS_OK:
+        raise Exception(body.decode(ossl.ENC))
+    return body
+
+# ============================================================ #
+
+async def main():
+    if not CONFIG.worker_socket:
+        raise Exception('WORKER_SOCKET is not set')
+    ossl.get_backend()
+    # the configured profile must run on the installed OpenSSL / cryptography
+    await asyncio.to_thread(ossl.get_backend().check_profile, ossl.get_profile())
+    await asyncio.to_thread(ossl.cleanup_spool)
+    server = WorkerServer(CONFIG.worker_socket, CONFIG.worker_procs, CONFIG.worker_queue,
+                          CONFIG.worker_batch)
+    await server.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())